@@ -0,0 +1,86 @@
+"""
+Journal inserts per second through update_database.add_food_entries at
+different batch sizes. Batch size 1 is what logging one dish at a time costs
+(add_food_entry is a batch of one).
+
+    python benchmarks/bulk_insert.py [--batch-sizes 1 10 100 1000 10000] [--entries 10000] [--json out.json]
+
+Every batch size inserts --entries entries (at least one full batch) into the
+same fresh DB, which is emptied in between.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+def make_entries(rng, count):
+    import synthetic
+
+    return [{
+        "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "meal_type": rng.choice(synthetic.MEAL_TYPES),
+        "food_item": rng.choice(synthetic.FOOD_ITEMS),
+        "dining_hall": rng.choice(synthetic.DINING_HALLS),
+        "notes": rng.choice(synthetic.NOTES),
+        "calories": round(rng.uniform(80, 750), 1),
+        "protein": round(rng.uniform(2, 40), 1),
+        "carbs": round(rng.uniform(5, 90), 1),
+        "fat": round(rng.uniform(1, 35), 1),
+    } for _ in range(count)]
+
+def run(batch_size, total, user_id):
+    import update_database
+    from db_connection import connection
+
+    entries = make_entries(random.Random(batch_size), max(total, batch_size))
+    start = time.perf_counter()
+    for i in range(0, len(entries), batch_size):
+        update_database.add_food_entries(user_id, entries[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+
+    with connection() as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM food_journal").fetchone()[0]
+        conn.execute("DELETE FROM food_journal")
+        conn.execute("DELETE FROM sync_changes")
+    assert stored == len(entries), f"expected {len(entries)} rows, found {stored}"
+
+    return {
+        "batch_size": batch_size,
+        "entries": len(entries),
+        "transactions": -(-len(entries) // batch_size),
+        "seconds": round(elapsed, 3),
+        "inserts_per_second": round(len(entries) / elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--entries", type=int, default=10000, help="entries inserted per batch size")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # update_database reads the DB path when it's imported
+        os.environ["WELLESLEY_CRAVE_DB_PATH"] = os.path.join(workdir, "bench.db")
+        import synthetic # puts the repo root on sys.path
+        import update_database
+
+        update_database.init_db()
+        user_id = update_database.get_or_create_user(synthetic.fake_email(0))
+
+        results = []
+        for batch_size in args.batch_sizes:
+            result = run(batch_size, args.entries, user_id)
+            result["speedup"] = round(result["inserts_per_second"] / results[0]["inserts_per_second"], 1) if results else 1.0
+            results.append(result)
+            print(f"batch {batch_size:>6}  {result['entries']:>7} entries in {result['transactions']:>6} transactions"
+                  f"  {result['seconds']:>8.3f} s  {result['inserts_per_second']:>9} inserts/s  x{result['speedup']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "bulk_insert", "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+A local stand-in for the parts of the GitHub contents API that db_sync uses, so
+syncing can be measured and checked without a token or network.
+
+    GET  /repos/<owner>/<repo>/contents/<path>   file (raw or JSON) or folder listing
+    PUT  /repos/<owner>/<repo>/contents/<path>   create/update, with GitHub's sha rules
+    DELETE /repos/<owner>/<repo>/contents/<path> delete, with the same sha rules
+
+Like GitHub: raw downloads and folder listings carry an ETag and answer
+If-None-Match with 304; updating or deleting an existing file needs its current
+blob sha (missing -> 422, stale -> 409); file shas are git blob hashes; a folder
+listing stops at the first 1,000 files.
+
+    python benchmarks/fake_github.py --port 8765 [--latency-ms 40]
+
+then set api_url = "http://127.0.0.1:8765" in the github secrets (or pass it to
+db_sync.configure_github). sync_benchmark.py starts one of these itself.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+RAW_MEDIA_TYPE = "application/vnd.github.v3.raw"
+INLINE_CONTENT_LIMIT = 1024 * 1024 # GitHub leaves "content" empty in JSON for files over 1 MB
+LISTING_LIMIT = 1000 # GitHub lists at most this many files in a folder
+
+def blob_sha(content):
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+class FakeGitHub:
+    """In-memory store plus traffic counters, shared by all request threads."""
+
+    def __init__(self, latency_ms=0):
+        self.files = {}  # (repo, path) -> bytes
+        self.lock = threading.Lock()
+        self.latency_ms = latency_ms
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "not_modified": 0, "conflicts": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def put_file(self, repo, path, content):
+        """Seed or overwrite a file directly, skipping the sha check."""
+        with self.lock:
+            self.files[(repo, path)] = content
+
+    def get_file(self, repo, path):
+        with self.lock:
+            return self.files.get((repo, path))
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    server_version = "FakeGitHub/1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def _parse_path(self):
+        # /repos/<owner>/<repo>/contents/<path>
+        parts = unquote(urlsplit(self.path).path).split("/")
+        if len(parts) < 6 or parts[1] != "repos" or parts[4] != "contents":
+            return None, None
+        return f"{parts[2]}/{parts[3]}", "/".join(parts[5:]).strip("/")
+
+    def _send(self, status, body=b"", headers=None):
+        if self.store.latency_ms:
+            time.sleep(self.store.latency_ms / 1000)
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        with self.store.lock:
+            self.store.stats["requests"] += 1
+            self.store.stats["bytes_out"] += len(body)
+            if status == 304:
+                self.store.stats["not_modified"] += 1
+            if status == 409:
+                self.store.stats["conflicts"] += 1
+
+    def _send_json(self, status, payload, headers=None):
+        headers = dict(headers or {}, **{"Content-Type": "application/json"})
+        self._send(status, json.dumps(payload).encode(), headers)
+
+    def _not_modified(self, etag):
+        return self.headers.get("If-None-Match") == etag
+
+    def do_GET(self):
+        repo, path = self._parse_path()
+        if repo is None:
+            return self._send_json(404, {"message": "Not Found"})
+
+        content = self.store.get_file(repo, path)
+        if content is not None:
+            sha = blob_sha(content)
+            etag = f'"{sha}"'
+            if self._not_modified(etag):
+                return self._send(304, headers={"ETag": etag})
+            if self.headers.get("Accept") == RAW_MEDIA_TYPE:
+                return self._send(200, content, {"ETag": etag, "Content-Type": "application/octet-stream"})
+            return self._send_json(200, {
+                "type": "file",
+                "name": path.rsplit("/", 1)[-1],
+                "path": path,
+                "sha": sha,
+                "size": len(content),
+                "encoding": "base64",
+                "content": base64.b64encode(content).decode() if len(content) <= INLINE_CONTENT_LIMIT else "",
+            }, {"ETag": f'W/"{sha}"'})
+
+        # A folder is any path that has files under it
+        prefix = path + "/"
+        with self.store.lock:
+            listing = [
+                {"type": "file", "name": file_path[len(prefix):], "path": file_path,
+                 "sha": blob_sha(file_content), "size": len(file_content)}
+                for (file_repo, file_path), file_content in sorted(self.store.files.items())
+                if file_repo == repo and file_path.startswith(prefix) and "/" not in file_path[len(prefix):]
+            ]
+        if not listing:
+            return self._send_json(404, {"message": "Not Found"})
+        listing = listing[:LISTING_LIMIT]
+        etag = '"' + hashlib.sha1(json.dumps(listing).encode()).hexdigest() + '"'
+        if self._not_modified(etag):
+            return self._send(304, headers={"ETag": etag})
+        self._send_json(200, listing, {"ETag": etag})
+
+    def do_PUT(self):
+        repo, path = self._parse_path()
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        with self.store.lock:
+            self.store.stats["bytes_in"] += len(raw_body)
+        if repo is None or not path:
+            return self._send_json(404, {"message": "Not Found"})
+        try:
+            body = json.loads(raw_body)
+            content = base64.b64decode(body["content"])
+        except (ValueError, KeyError):
+            return self._send_json(400, {"message": "Problems parsing JSON"})
+
+        # Check and write under the lock so two PUTs can't both pass the sha check
+        with self.store.lock:
+            current = self.store.files.get((repo, path))
+            if current is not None:
+                if "sha" not in body:
+                    status = 422
+                elif body["sha"] != blob_sha(current):
+                    status = 409
+                else:
+                    status = 200
+            else:
+                status = 201
+            if status in (200, 201):
+                self.store.files[(repo, path)] = content
+
+        if status == 422:
+            return self._send_json(422, {"message": "Invalid request.\n\n\"sha\" wasn't supplied."})
+        if status == 409:
+            return self._send_json(409, {"message": f"{path} does not match {body['sha']}"})
+        self._send_json(status, {"content": {"name": path.rsplit("/", 1)[-1], "path": path,
+                                             "sha": blob_sha(content), "size": len(content)}})
+
+    def do_DELETE(self):
+        repo, path = self._parse_path()
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        with self.store.lock:
+            self.store.stats["bytes_in"] += len(raw_body)
+        if repo is None or not path:
+            return self._send_json(404, {"message": "Not Found"})
+        try:
+            body = json.loads(raw_body)
+        except ValueError:
+            return self._send_json(400, {"message": "Problems parsing JSON"})
+
+        with self.store.lock:
+            current = self.store.files.get((repo, path))
+            if current is None:
+                status = 404
+            elif "sha" not in body:
+                status = 422
+            elif body["sha"] != blob_sha(current):
+                status = 409
+            else:
+                status = 200
+                del self.store.files[(repo, path)]
+
+        if status == 404:
+            return self._send_json(404, {"message": "Not Found"})
+        if status == 422:
+            return self._send_json(422, {"message": "Invalid request.\n\n\"sha\" wasn't supplied."})
+        if status == 409:
+            return self._send_json(409, {"message": f"{path} does not match {body['sha']}"})
+        self._send_json(200, {"content": None})
+
+def start_server(store=None, host="127.0.0.1", port=0):
+    """
+    Starts a fake API in a background thread. Returns (server, base url);
+    server.store is the FakeGitHub, server.shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.store = store or FakeGitHub()
+    threading.Thread(target=server.serve_forever, name="fake-github", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every response")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.store = FakeGitHub(args.latency_ms)
+    print(f"Fake GitHub contents API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Reading one heavy logger's journal history: the whole thing with
+get_food_entries versus one page at a time with get_food_entries_page, at the
+start and deep into the history, plus LIMIT/OFFSET for comparison.
+
+    python benchmarks/history_pagination.py [--entries 100000] [--page-size 50] [--json out.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+def timed(fn, repeat=5):
+    """Best of `repeat` runs, in milliseconds, and the last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000, help="journal entries for the one user")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # update_database reads the DB path when it's imported
+        os.environ["WELLESLEY_CRAVE_DB_PATH"] = os.path.join(workdir, "bench.db")
+        import synthetic # puts the repo root on sys.path
+        import update_database
+        from db_connection import connection
+
+        [(user_id, _)] = synthetic.make_db(os.environ["WELLESLEY_CRAVE_DB_PATH"], 1, args.entries)
+        size = args.page_size
+
+        # Cursor at the middle of the history, found by walking the pages once
+        middle, after, pages = None, None, 0
+        while True:
+            _, after = update_database.get_food_entries_page(user_id, size, after)
+            pages += 1
+            if pages == args.entries // size // 2:
+                middle = after
+            if after is None:
+                break
+
+        def offset_page(offset):
+            with connection() as conn:
+                return conn.execute(
+                    f"SELECT {update_database.JOURNAL_COLUMNS} FROM food_journal WHERE user_id = ? "
+                    "ORDER BY date DESC, meal_type, entry_id LIMIT ? OFFSET ?",
+                    (user_id, size, offset)).fetchall()
+
+        cases = [
+            ("get_food_entries (whole history)", lambda: update_database.get_food_entries(user_id), 3),
+            ("first page", lambda: update_database.get_food_entries_page(user_id, size), 20),
+            ("middle page (keyset cursor)", lambda: update_database.get_food_entries_page(user_id, size, middle), 20),
+            ("middle page (OFFSET)", lambda: offset_page(args.entries // 2), 20),
+            ("iter_food_entries (whole history)", lambda: sum(1 for _ in update_database.iter_food_entries(user_id)), 3),
+        ]
+        results = []
+        for name, fn, repeat in cases:
+            ms, _ = timed(fn, repeat)
+            results.append({"case": name, "ms": ms})
+            print(f"{name:<36} {ms:>10.3f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "history_pagination", "entries": args.entries,
+                       "page_size": args.page_size, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
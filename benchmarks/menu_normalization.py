@@ -0,0 +1,108 @@
+"""
+menus.normalize_menu against the per-row cleaning it replaced, on a synthetic
+week of every hall and meal shaped like AVI's menu-items payload.
+
+    python benchmarks/menu_normalization.py [--days 7] [--dishes 60] [--repeat 5] [--json out.json]
+
+Reports the best of --repeat runs for each and the frame's memory footprint.
+"""
+import argparse
+import copy
+import json
+import random
+import time
+
+import synthetic # puts the repo root on sys.path
+import menus
+import pandas as pd
+from dietary import ALLERGENS, RESTRICTIONS, dish_masks
+
+STATIONS = ["Grill", "Pizza", "Deli", "Soup", "Salad Bar", "Wok", "Bakery", "Global", "Home Style"]
+NUTRIENTS = ["calories", "protein", "fat", "carbohydrates", "sodium", "sugar", "dietaryFiber",
+             "cholesterol", "saturatedFat", "transFat", "servingSize"]
+
+def fake_week(days, dishes, seed=248):
+    """days x every hall/meal in menus.MENU_IDS, `dishes` items each."""
+    rng = random.Random(seed)
+    items = []
+    for day in range(days):
+        for info in menus.MENU_IDS:
+            for i in range(dishes):
+                nutritionals = {key: round(rng.uniform(0, 600), 1) for key in NUTRIENTS}
+                nutritionals.update({"id": rng.getrandbits(31), "corporateProductId": rng.getrandbits(31),
+                                     "caloriesFromSatFat": round(rng.uniform(0, 90), 1),
+                                     "servingSizeUOM": rng.choice(["oz", "cup", "each"])})
+                items.append({
+                    "id": len(items),
+                    "date": f"2025-04-{14 + day:02d}T00:00:00",
+                    "name": rng.choice(synthetic.FOOD_ITEMS),
+                    "image": None,
+                    "categoryName": "Entree",
+                    "stationName": rng.choice(STATIONS),
+                    "stationOrder": i,
+                    "price": 0,
+                    "allergens": [{"id": 0, "name": name} for name in rng.sample(ALLERGENS, rng.choice([0, 1, 1, 2, 3]))],
+                    "preferences": [{"id": 0, "name": name} for name in rng.sample(RESTRICTIONS, rng.choice([0, 1, 2]))],
+                    "nutritionals": nutritionals,
+                })
+    return items
+
+# The cleaning homePage did before normalize_menu, kept here for comparison
+def _transform(cell):
+    return ",".join([item["name"] for item in cell]) if cell else ""
+
+def _drop_keys(cell):
+    cell.pop("id")
+    cell.pop("corporateProductId")
+    cell.pop("caloriesFromSatFat")
+    return cell
+
+def legacy_normalize(items):
+    masks = [dish_masks(dish) for dish in items] # the food journal's per-item filter work
+    df = pd.DataFrame(items)
+    df["allergen_mask"] = [a for a, _ in masks]
+    df["restriction_mask"] = [r for _, r in masks]
+    df = df.drop_duplicates(subset=["id"], keep="first")
+    df = df.drop(columns=["image", "id", "categoryName", "stationOrder", "price"], errors="ignore")
+    df["allergens"] = df["allergens"].apply(_transform)
+    df["preferences"] = df["preferences"].apply(_transform)
+    df["nutritionals"] = df["nutritionals"].apply(_drop_keys)
+    for key in df.iloc[0].nutritionals.keys():
+        if key == "servingSizeUOM":
+            df[key] = df["nutritionals"].apply(lambda dct: str(dct["servingSizeUOM"]))
+        else:
+            df[key] = df["nutritionals"].apply(lambda dct: float(dct[key]))
+    return df.drop("nutritionals", axis=1)
+
+def best_of(fn, items, repeat):
+    best, df = None, None
+    for _ in range(repeat):
+        fresh = copy.deepcopy(items) # the legacy path mutates the nutritionals dicts
+        start = time.perf_counter()
+        df = fn(fresh)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 2), df
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--dishes", type=int, default=60, help="items per hall/meal menu")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    items = fake_week(args.days, args.dishes)
+    results = []
+    for name, fn in [("per-row apply (before)", legacy_normalize), ("normalize_menu", menus.normalize_menu)]:
+        ms, df = best_of(fn, items, args.repeat)
+        kib = round(df.memory_usage(deep=True).sum() / 1024, 1)
+        results.append({"case": name, "items": len(items), "ms": ms, "memory_kib": kib})
+        print(f"{name:<24} {len(items):>6} items  {ms:>9.2f} ms  {kib:>9.1f} KiB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "menu_normalization", "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Transfer size and wall-clock time of the DB snapshot formats in db_sync.
+
+    python benchmarks/snapshot_compression.py [--rows 1000 10000 100000] [--mbps 20] [--json out.json]
+
+For each journal size it builds a synthetic DB, packs it in every format this
+machine supports and reports the base64 payload GitHub would receive, the time
+to pack and unpack it, and the total including transfer at --mbps.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import synthetic
+import db_sync
+
+def measure(db_path, snapshot_format, mbps, workdir):
+    packed_path = os.path.join(workdir, "packed")
+    unpacked_path = os.path.join(workdir, "unpacked.db")
+
+    start = time.perf_counter()
+    if snapshot_format == "raw":
+        packed_path = db_path
+    else:
+        db_sync.compress_snapshot(db_path, packed_path, snapshot_format)
+    pack_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if snapshot_format != "raw":
+        db_sync.decompress_snapshot(packed_path, unpacked_path)
+    unpack_s = time.perf_counter() - start
+
+    packed_bytes = os.path.getsize(packed_path)
+    upload_bytes = 4 * ((packed_bytes + 2) // 3) # base64 in the contents API PUT
+    transfer_s = (upload_bytes + packed_bytes) * 8 / (mbps * 1_000_000) # push + raw download
+    return {
+        "format": snapshot_format,
+        "packed_bytes": packed_bytes,
+        "upload_bytes": upload_bytes,
+        "pack_ms": round(pack_s * 1000, 1),
+        "unpack_ms": round(unpack_s * 1000, 1),
+        "round_trip_ms": round((pack_s + unpack_s + transfer_s) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--mbps", type=float, default=20.0, help="link speed used for the transfer estimate")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    formats = ["raw", "gzip"] + (["zstd"] if db_sync.zstandard is not None else [])
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.db")
+        for rows in args.rows:
+            users = max(1, rows // 500)
+            synthetic.make_db(db_path, users, rows // users)
+            raw_bytes = os.path.getsize(db_path)
+            baseline = None
+            for snapshot_format in formats:
+                result = measure(db_path, snapshot_format, args.mbps, workdir)
+                result.update(rows=rows, raw_bytes=raw_bytes)
+                baseline = baseline or result
+                result["size_ratio"] = round(result["packed_bytes"] / raw_bytes, 3)
+                result["time_saved_ms"] = round(baseline["round_trip_ms"] - result["round_trip_ms"], 1)
+                results.append(result)
+                print(f"{rows:>7} rows  {snapshot_format:<5} {result['upload_bytes'] / 1024:>10.1f} KiB up"
+                      f"  x{result['size_ratio']:<6} pack {result['pack_ms']:>8.1f} ms"
+                      f"  unpack {result['unpack_ms']:>7.1f} ms  round trip {result['round_trip_ms']:>8.1f} ms"
+                      f"  saved {result['time_saved_ms']:>8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "snapshot_compression", "mbps": args.mbps, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
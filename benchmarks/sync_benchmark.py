@@ -0,0 +1,321 @@
+"""
+Drives db_sync against the fake contents API (fake_github.py) and reports p50/p95
+sync latency and bytes on the wire.
+
+    python benchmarks/sync_benchmark.py [--rows 1000 10000] [--replicas 1 4]
+        [--writes-per-sync 1 10] [--syncs 20] [--modes delta snapshot]
+        [--snapshot-format gzip] [--latency-ms 20] [--json out.json]
+
+Every combination of the options is one run. Each replica is its own process with
+its own DB file, like separate app instances sharing one repo. A replica starts
+from a full download, then each round writes --writes-per-sync journal entries,
+pushes them (timed as "push"), and does the download check a page rerun does
+(timed as "pull").
+
+It also checks that nothing was lost: after every run, and after a short run where
+the replicas push one after another from copies that are already out of date, a
+fresh replica counts the replicas' users and rows on the remote. In delta mode a
+short run with COMPACT_AFTER_CHANGESETS lowered to 5 checks that compaction
+prunes the changes folder. It exits with an error if any check fails.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import fake_github
+
+REPO = "bench/wellesley-crave"
+DB_FILE = "wellesley_crave.db"
+
+def _percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(p * len(samples)))], 1)
+
+def _github_settings(api_url, mode, snapshot_format):
+    return {"token": "bench", "repo": REPO, "db_path": DB_FILE, "api_url": api_url,
+            "sync_mode": mode, "snapshot_format": snapshot_format}
+
+def _open_replica(name, workdir, api_url, mode, snapshot_format):
+    """
+    Points this process at its own DB file and downloads the repo's copy into it.
+    db_sync is imported only once DB_PATH points at that file.
+    """
+    os.environ["WELLESLEY_CRAVE_DB_PATH"] = os.path.join(workdir, f"{name}.db")
+    logging.getLogger("streamlit").setLevel(logging.ERROR) # no Streamlit runtime here, that's fine
+
+    import synthetic # puts the repo root on sys.path
+    import db_sync
+    import update_database
+
+    db_sync.configure_github(_github_settings(api_url, mode, snapshot_format))
+    db_sync.download_db_from_github(force=True)
+    return db_sync, update_database
+
+def _replica(job):
+    """Runs in its own process, one per replica."""
+    replica, workdir, api_url, mode, snapshot_format, writes_per_sync, syncs = job
+    db_sync, update_database = _open_replica(f"replica-{replica}", workdir, api_url, mode, snapshot_format)
+    import synthetic
+    user_id = update_database.get_or_create_user(f"replica{replica}@wellesley.edu")
+
+    rng = random.Random(replica)
+    day = date(2025, 9, 1)
+    push_ms, pull_ms, failures = [], [], 0
+    for _ in range(syncs):
+        for _ in range(writes_per_sync):
+            update_database.add_food_entry(user_id, day.isoformat(), rng.choice(synthetic.MEAL_TYPES),
+                                           rng.choice(synthetic.FOOD_ITEMS), rng.choice(synthetic.DINING_HALLS),
+                                           "", 350.0, 20.0, 40.0, 12.0)
+        day += timedelta(days=1)
+
+        start = time.perf_counter()
+        if not db_sync.sync_db_to_github():
+            failures += 1
+        push_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        db_sync.download_db_from_github()
+        pull_ms.append((time.perf_counter() - start) * 1000)
+
+    return {"push_ms": push_ms, "pull_ms": pull_ms, "failures": failures, "sync_stats": db_sync.get_sync_stats()}
+
+def _remote_rows(job):
+    """A fresh replica's view of the repo: (replica users, their journal rows)."""
+    workdir, api_url, mode, snapshot_format = job
+    _open_replica("checker", workdir, api_url, mode, snapshot_format)
+    from db_connection import connection
+
+    with connection() as conn:
+        users = conn.execute("SELECT COUNT(*) FROM users WHERE email LIKE 'replica%'").fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM food_journal JOIN users USING (user_id) "
+                            "WHERE email LIKE 'replica%'").fetchone()[0]
+    return users, rows
+
+def _small_repo(workdir, snapshot_format):
+    """A fake API seeded with a tiny DB, for the checks. Returns (server, api url)."""
+    import synthetic
+    import db_sync
+
+    seed_path = os.path.join(workdir, "seed.db")
+    synthetic.make_db(seed_path, 2, 5)
+    if snapshot_format != "raw":
+        db_sync.compress_snapshot(seed_path, seed_path + ".packed", snapshot_format)
+        seed_path += ".packed"
+    server, api_url = fake_github.start_server()
+    with open(seed_path, "rb") as f:
+        server.store.put_file(REPO, DB_FILE, f.read())
+    return server, api_url
+
+def _stepped_replica(replica, workdir, api_url, mode, snapshot_format, downloaded, turn, results):
+    """Downloads, waits for its turn, then writes one entry and pushes it."""
+    db_sync, update_database = _open_replica(f"replica-{replica}", workdir, api_url, mode, snapshot_format)
+    downloaded.set()
+    turn.wait()
+    user_id = update_database.get_or_create_user(f"replica{replica}@wellesley.edu")
+    update_database.add_food_entry(user_id, "2025-09-01", "Lunch", "Check Bowl", "Tower", "", 500.0, 20.0, 60.0, 15.0)
+    results.put(db_sync.sync_db_to_github())
+
+def check_sequential_pushes(mode, snapshot_format, replicas=2):
+    """
+    Every replica downloads first, then they write and push one after another, so
+    no two pushes overlap but each one starts from a copy that's older than the
+    remote. Those pushes have to merge instead of overwriting the one before.
+    Returns (failed pushes, users missing from the remote, rows missing from it).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        server, api_url = _small_repo(workdir, snapshot_format)
+        try:
+            results = ctx.Queue()
+            steps = [(ctx.Event(), ctx.Event()) for _ in range(replicas)]
+            processes = [ctx.Process(target=_stepped_replica, args=(replica, workdir, api_url, mode,
+                                                                    snapshot_format, downloaded, turn, results))
+                         for replica, (downloaded, turn) in enumerate(steps)]
+            for process in processes:
+                process.start()
+            for downloaded, _ in steps:
+                downloaded.wait()
+            pushed = []
+            for _, turn in steps:
+                turn.set()
+                pushed.append(results.get()) # the next replica goes once this push is done
+            for process in processes:
+                process.join()
+            with ctx.Pool(1) as pool:
+                users, rows = pool.apply(_remote_rows, ((workdir, api_url, mode, snapshot_format),))
+        finally:
+            server.shutdown()
+    return pushed.count(False), replicas - users, replicas - rows
+
+def _wait_for_flush(db_sync, flushes_before, timeout=30):
+    deadline = time.monotonic() + timeout
+    while db_sync.flush_stats["flushes"] + db_sync.flush_stats["failed_flushes"] <= flushes_before:
+        if time.monotonic() > deadline:
+            raise RuntimeError("the flusher never got to the push")
+        time.sleep(0.02)
+
+def _compacting_replica(job):
+    """
+    Writes one entry per round and lets the background flusher push it, then does
+    a page's download check, which asks for a compaction every compact_after
+    changesets. Returns the most changeset files the folder held after a round.
+    """
+    workdir, api_url, snapshot_format, compact_after, rounds = job
+    db_sync, update_database = _open_replica("replica-0", workdir, api_url, "delta", snapshot_format)
+    db_sync.COMPACT_AFTER_CHANGESETS = compact_after
+    db_sync.FLUSH_DELAY_SECONDS = db_sync.FLUSH_MAX_DELAY_SECONDS = 0.05
+    import http_client
+
+    token, repo, path, changes_path = db_sync._github_settings()
+    user_id = update_database.get_or_create_user("replica0@wellesley.edu")
+    most_files = 0
+    for day in range(rounds):
+        update_database.add_food_entry(user_id, f"2025-09-{day + 1:02d}", "Lunch", "Check Bowl", "Tower",
+                                       "", 500.0, 20.0, 60.0, 15.0)
+        flushes = db_sync.flush_stats["flushes"] + db_sync.flush_stats["failed_flushes"]
+        db_sync.request_sync()
+        _wait_for_flush(db_sync, flushes)
+
+        flushes = db_sync.flush_stats["flushes"] + db_sync.flush_stats["failed_flushes"]
+        db_sync.download_db_from_github()
+        if db_sync._flusher["compact"]:
+            _wait_for_flush(db_sync, flushes) # the compaction, with its prune
+
+        r = http_client.get(db_sync._contents_url(repo, changes_path), headers={"Authorization": f"token {token}"})
+        most_files = max(most_files, len(r.json()) if r.status_code == 200 else 0)
+    return most_files, db_sync.get_sync_stats()["changesets_pruned"]
+
+def check_compaction(snapshot_format, compact_after=5, rounds=17):
+    """
+    Runs the flusher's compaction with COMPACT_AFTER_CHANGESETS lowered to
+    compact_after. The changes folder should never grow past compact_after files
+    (each compaction prunes what it folded in), and a fresh replica should still
+    see every row. Returns (most files seen, changesets pruned, rows missing).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        server, api_url = _small_repo(workdir, snapshot_format)
+        try:
+            with ctx.Pool(1) as pool:
+                most_files, pruned = pool.apply(_compacting_replica,
+                                                ((workdir, api_url, snapshot_format, compact_after, rounds),))
+            with ctx.Pool(1) as pool:
+                users, rows = pool.apply(_remote_rows, ((workdir, api_url, "delta", snapshot_format),))
+        finally:
+            server.shutdown()
+    return most_files, pruned, rounds - rows
+
+def run(rows, replicas, writes_per_sync, syncs, mode, snapshot_format, latency_ms):
+    import synthetic
+    import db_sync
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Seed the fake repo with a synthetic DB in the format the replicas upload in
+        seed_path = os.path.join(workdir, "seed.db")
+        users = max(1, rows // 500)
+        synthetic.make_db(seed_path, users, rows // users)
+        if snapshot_format != "raw":
+            db_sync.compress_snapshot(seed_path, seed_path + ".packed", snapshot_format)
+            seed_path += ".packed"
+        with open(seed_path, "rb") as f:
+            seed = f.read()
+
+        server, api_url = fake_github.start_server(fake_github.FakeGitHub(latency_ms))
+        server.store.put_file(REPO, DB_FILE, seed)
+        try:
+            jobs = [(replica, workdir, api_url, mode, snapshot_format, writes_per_sync, syncs)
+                    for replica in range(replicas)]
+            with multiprocessing.get_context("spawn").Pool(replicas) as pool:
+                results = pool.map(_replica, jobs)
+                users, stored_rows = pool.apply(_remote_rows, ((workdir, api_url, mode, snapshot_format),))
+            server_stats = dict(server.store.stats)
+        finally:
+            server.shutdown()
+
+    push_ms = [ms for result in results for ms in result["push_ms"]]
+    pull_ms = [ms for result in results for ms in result["pull_ms"]]
+    wire_bytes = server_stats["bytes_in"] + server_stats["bytes_out"]
+    rounds = replicas * syncs
+    return {
+        "rows": rows,
+        "replicas": replicas,
+        "writes_per_sync": writes_per_sync,
+        "syncs": syncs,
+        "mode": mode,
+        "snapshot_format": snapshot_format,
+        "latency_ms": latency_ms,
+        "seed_bytes": len(seed),
+        "push_p50_ms": _percentile(push_ms, 0.50),
+        "push_p95_ms": _percentile(push_ms, 0.95),
+        "pull_p50_ms": _percentile(pull_ms, 0.50),
+        "pull_p95_ms": _percentile(pull_ms, 0.95),
+        "failed_pushes": sum(result["failures"] for result in results),
+        "conflicts": server_stats["conflicts"],
+        # what a fresh replica is missing once everyone is done; anything but 0 is a bug
+        "lost_users": replicas - users,
+        "lost_rows": replicas * syncs * writes_per_sync - stored_rows,
+        "requests": server_stats["requests"],
+        "wire_bytes": wire_bytes,
+        # minus the one full download each replica starts with
+        "wire_bytes_per_round": round((wire_bytes - replicas * len(seed)) / rounds),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--writes-per-sync", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--syncs", type=int, default=20, help="rounds per replica")
+    parser.add_argument("--modes", nargs="+", default=["delta", "snapshot"], choices=["delta", "snapshot"])
+    parser.add_argument("--snapshot-format", default="gzip", choices=["raw", "gzip", "zstd"])
+    parser.add_argument("--latency-ms", type=float, default=20, help="added to every fake API response")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    lost = 0
+    for mode in args.modes:
+        failed, lost_users, lost_rows = check_sequential_pushes(mode, args.snapshot_format)
+        lost += lost_users + lost_rows
+        print(f"sequential pushes, {mode}: {failed} failed, {lost_users} users and {lost_rows} rows lost")
+    if "delta" in args.modes:
+        compact_after = 5
+        most_files, pruned, lost_rows = check_compaction(args.snapshot_format, compact_after)
+        lost += lost_rows
+        shrank = most_files <= compact_after and pruned > 0
+        lost += not shrank
+        print(f"compaction every {compact_after} changesets: at most {most_files} changeset files, "
+              f"{pruned} pruned, {lost_rows} rows lost")
+
+    results = []
+    for rows in args.rows:
+        for mode in args.modes:
+            for replicas in args.replicas:
+                for writes_per_sync in args.writes_per_sync:
+                    result = run(rows, replicas, writes_per_sync, args.syncs, mode,
+                                 args.snapshot_format, args.latency_ms)
+                    results.append(result)
+                    print(f"{rows:>7} rows {mode:<8} x{replicas:<2} {writes_per_sync:>3} writes/sync"
+                          f"  push p50 {result['push_p50_ms']:>8.1f} p95 {result['push_p95_ms']:>8.1f} ms"
+                          f"  pull p50 {result['pull_p50_ms']:>7.1f} p95 {result['pull_p95_ms']:>7.1f} ms"
+                          f"  {result['wire_bytes_per_round'] / 1024:>9.1f} KiB/round"
+                          f"  conflicts {result['conflicts']:>3}  failed {result['failed_pushes']}"
+                          f"  lost {result['lost_users']} users/{result['lost_rows']} rows")
+                    lost += result["lost_users"] + result["lost_rows"]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "sync", "results": results}, f, indent=2)
+
+    if lost:
+        raise SystemExit("some replicas' writes never reached the remote, or compaction didn't prune")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Deterministic fake data for the benchmarks: users with journal entries spread
+over realistic dates, dining halls and meal types. Same seed, same DB.
+"""
+import os
+import random
+import sqlite3
+import sys
+import uuid
+from datetime import date, timedelta
+
+# Let the benchmarks import the app modules when run as `python benchmarks/<file>.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import update_database
+from dietary import ALLERGENS, RESTRICTIONS, encode_allergens, encode_restrictions
+
+DINING_HALLS = ["Bates", "Lulu", "Stone D", "Tower"]
+MEAL_TYPES = ["Breakfast", "Lunch", "Dinner", "Snack"]
+FOOD_ITEMS = [
+    "Scrambled Eggs", "Buttermilk Pancakes", "Oatmeal", "Turkey Sausage", "Hash Browns",
+    "Greek Yogurt", "Fresh Fruit Salad", "Bagel with Cream Cheese", "Grilled Chicken Breast",
+    "Cheese Pizza", "Pepperoni Pizza", "Caesar Salad", "Tomato Basil Soup", "Chicken Noodle Soup",
+    "Black Bean Burger", "Beef Tacos", "Vegetable Stir Fry", "Jasmine Rice", "Brown Rice",
+    "Penne Marinara", "Mac and Cheese", "Roasted Broccoli", "Steamed Green Beans",
+    "Baked Salmon", "Tofu Curry", "Falafel Wrap", "Hummus and Pita", "French Fries",
+    "Chocolate Chip Cookie", "Apple Crisp", "Garden Salad", "Quinoa Bowl", "Teriyaki Chicken",
+    "Lentil Soup", "Grilled Cheese", "Roasted Sweet Potatoes", "Cheese Quesadilla",
+    "Chicken Tikka Masala", "Vegetable Lo Mein", "Banana Muffin",
+]
+NOTES = ["", "", "", "", "Post practice", "Late lunch", "With friends", "Too salty"]
+
+def fake_email(i):
+    return f"student{i:07d}@wellesley.edu"
+
+def journal_rows(rng, user_id, count, start=date(2024, 9, 1)):
+    """Yields food_journal tuples for one user, a few items per meal, day by day."""
+    day = start
+    while count > 0:
+        for meal_type in rng.sample(MEAL_TYPES, rng.randint(1, 3)):
+            hall = rng.choice(DINING_HALLS)
+            note = rng.choice(NOTES)
+            for _ in range(min(count, rng.randint(1, 4))):
+                calories = round(rng.uniform(80, 750), 1)
+                yield (str(uuid.UUID(int=rng.getrandbits(128))), user_id, day.isoformat(), meal_type,
+                       rng.choice(FOOD_ITEMS), hall, note, calories,
+                       round(calories * rng.uniform(0.02, 0.08), 1),
+                       round(calories * rng.uniform(0.05, 0.15), 1),
+                       round(calories * rng.uniform(0.01, 0.05), 1))
+                count -= 1
+            if count == 0:
+                return
+        day += timedelta(days=1)
+
+def make_db(path, users, entries_per_user, seed=248):
+    """
+    Creates a fresh DB at path with `users` users and `entries_per_user` journal
+    entries each. Returns the list of (user_id, email).
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    update_database.init_db(path)
+    rng = random.Random(seed)
+
+    conn = sqlite3.connect(path)
+    created = []
+    for i in range(users):
+        email = fake_email(i)
+        allergens = rng.sample(ALLERGENS, rng.choice([0, 0, 0, 1, 2]))
+        restrictions = rng.sample(RESTRICTIONS, rng.choice([0, 0, 1]))
+        cursor = conn.execute(
+            "INSERT INTO users (email, diningHall, allergen_mask, restriction_mask) VALUES (?, ?, ?, ?)",
+            (email, rng.choice(DINING_HALLS), encode_allergens(allergens), encode_restrictions(restrictions))
+        )
+        user_id = cursor.lastrowid
+        created.append((user_id, email))
+        conn.executemany(
+            "INSERT INTO food_journal (entry_id, user_id, date, meal_type, food_item, dining_hall, notes, "
+            "calories, protein, carbs, fat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            journal_rows(rng, user_id, entries_per_user)
+        )
+    conn.commit()
+    conn.close()
+    return created
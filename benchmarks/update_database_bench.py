@@ -0,0 +1,156 @@
+"""
+Timings for the update_database functions the pages call, as the journal grows.
+
+    python benchmarks/update_database_bench.py [--rows 1000 10000 1000000] [--entries-per-user 100]
+        [--repeat 50] [--json out.json]
+
+For each --rows it builds a synthetic DB (synthetic.make_db, same seed every
+time) with rows / --entries-per-user users, then times each case --repeat
+times against random users (fewer for the cases that read the whole table) and
+reports p50/p95 in milliseconds. The JSON output records the commit and the
+SQLite version next to the numbers, so runs from different commits can be
+diffed case by case.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(fn, repeat):
+    """p50/p95 of repeat calls of fn(i), in milliseconds."""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "n": repeat,
+        "p50_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(repeat - 1, int(repeat * 0.95))], 4),
+    }
+
+def fake_menu(rng, dishes=200):
+    """Menu items shaped like the AVI API's, with allergens and preferences."""
+    from dietary import ALLERGENS, RESTRICTIONS
+
+    return [{
+        "name": f"Dish {i}",
+        "allergens": [{"name": name} for name in rng.sample(ALLERGENS, rng.choice([0, 1, 1, 2, 3]))],
+        "preferences": [{"name": name} for name in rng.sample(RESTRICTIONS, rng.choice([0, 1, 2]))],
+    } for i in range(dishes)]
+
+def cases(users, rng, repeat, full_scan_repeat):
+    """(name, fn(i), repeat) for every timed call. fn gets the iteration number."""
+    import update_database
+    import synthetic
+    from dietary import dish_masks, dish_allowed, parse_legacy_list, encode_allergens, encode_restrictions
+
+    picks = [rng.choice(users) for _ in range(repeat)]
+    menu = fake_menu(rng)
+    menu_masks = [dish_masks(dish) for dish in menu]
+    # synthetic.journal_rows starts every user on 2024-09-01 at a few entries a day
+    dates = [f"2024-09-{rng.randint(1, 20):02d}" for _ in range(repeat)]
+
+    def cold_user_info(i):
+        update_database.invalidate_user_profile()
+        update_database.fetch_user_info(picks[i][1])
+
+    def add_entry(i):
+        update_database.add_food_entry(picks[i][0], dates[i], "Lunch", "Benchmark Bowl", "Tower",
+                                       calories=500.0, protein=20.0, carbs=60.0, fat=15.0)
+
+    def favorite_roundtrip(i):
+        email = picks[i][1]
+        update_database.add_favorite_dish(email, "Benchmark Bowl")
+        update_database.remove_favorite_dish(email, "Benchmark Bowl")
+
+    def allergen_filter_masks(i):
+        # What home/food journal do now: two ints from the (cached) profile, then ANDs
+        user_a, user_r = update_database.get_user_dietary_masks(picks[i][1])
+        return [dish for dish, (a, r) in zip(menu, menu_masks) if dish_allowed(a, r, user_a, user_r)]
+
+    legacy_text = [(str(rng.sample(synthetic.ALLERGENS, 2)), str(rng.sample(synthetic.RESTRICTIONS, 1)))
+                   for _ in range(repeat)]
+
+    def allergen_filter_legacy(i):
+        # The old path for comparison: parse the text columns, then encode every dish per rerun
+        allergens, restrictions = (parse_legacy_list(text) for text in legacy_text[i])
+        user_a, user_r = encode_allergens(allergens), encode_restrictions(restrictions)
+        return [dish for dish in menu if dish_allowed(*dish_masks(dish), user_a, user_r)]
+
+    return [
+        ("get_food_entries (whole history)", lambda i: update_database.get_food_entries(picks[i][0]), repeat),
+        ("get_food_entries (one date)", lambda i: update_database.get_food_entries(picks[i][0], dates[i]), repeat),
+        ("get_food_entries_page (first page)", lambda i: update_database.get_food_entries_page(picks[i][0]), repeat),
+        ("fetch_food_journal (every row)", lambda i: update_database.fetch_food_journal(), full_scan_repeat),
+        ("fetch_user_info (cold)", cold_user_info, repeat),
+        ("fetch_user_info (cached)", lambda i: update_database.fetch_user_info(picks[0][1]), repeat),
+        ("add_food_entry", add_entry, repeat),
+        ("add + remove favorite", favorite_roundtrip, repeat),
+        ("allergen filter, 200 dishes (masks)", allergen_filter_masks, repeat),
+        ("allergen filter, 200 dishes (legacy text)", allergen_filter_legacy, repeat),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 1000000], help="total journal entries")
+    parser.add_argument("--entries-per-user", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50, help="calls per case")
+    parser.add_argument("--full-scan-repeat", type=int, default=3, help="calls for fetch_food_journal")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # update_database reads the DB path when it's imported
+        db_path = os.path.join(workdir, "bench.db")
+        os.environ["WELLESLEY_CRAVE_DB_PATH"] = db_path
+        import synthetic # puts the repo root on sys.path
+        import update_database
+        import db_connection
+
+        for rows in args.rows:
+            users = max(1, rows // args.entries_per_user)
+            start = time.perf_counter()
+            # Built next to the app DB and swapped in the way db_sync installs a
+            # download, since pooled connections and cached profiles still point at
+            # the previous size's file
+            created = synthetic.make_db(db_path + ".next", users, rows // users)
+            with db_connection.exclusive_access():
+                os.replace(db_path + ".next", db_path)
+            update_database.invalidate_user_profile()
+            print(f"{rows} rows, {users} users (built in {time.perf_counter() - start:.1f} s)")
+
+            rng = random.Random(rows)
+            for name, fn, repeat in cases(created, rng, args.repeat, args.full_scan_repeat):
+                result = {"rows": rows, "users": users, "case": name, **timed(fn, repeat)}
+                results.append(result)
+                print(f"    {name:<44} p50 {result['p50_ms']:>10.3f} ms  p95 {result['p95_ms']:>10.3f} ms  (n={repeat})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "benchmark": "update_database",
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "entries_per_user": args.entries_per_user,
+                "results": results,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from db_sync import get_db_path
+
+# A small pool of SQLite connections, opened once and lent to whichever thread runs
+# a query, instead of a connect/close around each query. The pragmas below are
+# applied once, when a connection is opened.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",     # readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",   # safe with WAL, skips an fsync per commit
+    "PRAGMA busy_timeout=5000",    # wait up to 5 s for a lock instead of failing
+    "PRAGMA cache_size=-8000",     # 8 MB page cache per connection
+    "PRAGMA mmap_size=67108864",   # read through a 64 MB memory map
+    "PRAGMA temp_store=MEMORY",
+]
+
+# Connections kept open between queries. Streamlit runs every rerun on a new thread,
+# so connections can't live as long as the thread that opened them.
+POOL_SIZE = 8
+
+connection_stats = {
+    "closed_for_swap": 0,   # closed because db_sync swapped in a new DB file
+}
+
+class _SharedExclusiveLock:
+    """
+    Any number of threads can hold it shared (running queries) or one thread can
+    hold it exclusive (swapping the DB file). Shared is re-entrant per thread, and
+    a waiting exclusive request stops new shared holders so it can't be starved.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def shared(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            with self._cond:
+                while self._exclusive or self._exclusive_waiting:
+                    self._cond.wait()
+                self._shared += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._cond:
+                    self._shared -= 1
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._exclusive_waiting += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._exclusive_waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+class ConnectionPool:
+    """
+    Open connections to one DB file. checkout() lends one to the calling thread and
+    takes it back when the block ends, keeping up to max_idle of them for the next
+    caller (any thread) and closing the rest. A thread that checks out again while
+    it already holds one gets the same connection, so nested calls share its
+    transaction (connection() leaves committing to the outermost block).
+    """
+
+    def __init__(self, get_path, setup=None, max_idle=POOL_SIZE):
+        self._get_path = get_path
+        self._setup = setup # called with each new connection after the pragmas
+        self.max_idle = max_idle
+        self._idle = []     # most recently returned last
+        self._open = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {
+            "opened": 0,      # new connections
+            "reused": 0,      # checkouts served by an already-open connection
+            "closed_idle": 0, # closed on return because max_idle were already waiting
+        }
+
+    def _open_connection(self):
+        conn = sqlite3.connect(self._get_path(), check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if self._setup:
+            self._setup(conn)
+        return conn
+
+    @contextmanager
+    def checkout(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self.stats["reused" if conn is not None else "opened"] += 1
+            if conn is None:
+                self._open += 1
+        if conn is None:
+            try:
+                conn = self._open_connection()
+            except BaseException:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction: # left open by a block that didn't use `with conn`
+                conn.rollback()
+            with self._lock:
+                keep = len(self._idle) < self.max_idle
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    self._open -= 1
+                    self.stats["closed_idle"] += 1
+            if not keep:
+                conn.close()
+
+    def close_all(self, before_close=None):
+        """
+        Closes every idle connection and returns how many. Connections that are
+        checked out right now are left alone.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            if before_close:
+                try:
+                    before_close(conn)
+                except sqlite3.Error:
+                    pass
+            conn.close()
+        return len(idle)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, open=self._open, idle=len(self._idle))
+
+_lock = _SharedExclusiveLock()
+_pool = ConnectionPool(get_db_path)
+_nesting = threading.local() # how many connection() blocks this thread is inside
+
+@contextmanager
+def connection(db_path=None):
+    """
+    Yields a pooled connection to the app DB. Commits when the block finishes
+    (if anything was written) and rolls back if it raises, like
+    `with sqlite3.connect(...) as conn` does. A connection() inside another one on
+    the same thread is part of the outer block's transaction: only the outermost
+    block commits or rolls back, so an inner block that raises undoes everything
+    once the error reaches it.
+
+    Other paths (a download being prepared, a snapshot) get a plain connection
+    that is closed afterwards.
+    """
+    if db_path is not None and db_path != get_db_path():
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+        return
+
+    depth = getattr(_nesting, "depth", 0)
+    with _lock.shared(), _pool.checkout() as conn:
+        _nesting.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if depth == 0 and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            _nesting.depth = depth
+        if depth == 0 and conn.in_transaction:
+            conn.commit()
+
+@contextmanager
+def exclusive_access():
+    """
+    Waits until no query is running, then checkpoints the WAL and closes every
+    pooled connection before handing over, so db_sync can swap a new file into
+    DB_PATH. Connections are reopened on the new file the next time they're needed.
+    """
+    db_path = get_db_path()
+    with _lock.exclusive():
+        # Nobody holds a connection while we're exclusive, so they're all idle
+        checkpoint = lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection_stats["closed_for_swap"] += _pool.close_all(before_close=checkpoint)
+        yield
+        # The -wal/-shm files belonged to the file that was just replaced; a
+        # connection to the new file must not pick them up
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+def get_connection_stats():
+    return dict(_pool.get_stats(), **connection_stats)
@@ -1,74 +1,850 @@
 import os
 import requests
+import http_client
 import base64
+import sqlite3
+import json
+import uuid
+import time
+import logging
+import threading
+import tempfile
+import gzip
+import hashlib
+import shutil
+import struct
+import random
+from datetime import datetime, timezone
 import streamlit as st
 
+try:
+    import zstandard # optional, only needed for snapshot_format = "zstd"
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
 # All of Prof. Eni Code from fresh-missing repo
 # Set the DB location in temp space for Streamlit Cloud
-DB_PATH = "/tmp/wellesely_crave.db"
+# (WELLESLEY_CRAVE_DB_PATH lets the benchmarks run several replicas side by side)
+DB_PATH = os.environ.get("WELLESLEY_CRAVE_DB_PATH", "/tmp/wellesely_crave.db")
+
+# Used instead of st.secrets["github"] when set through configure_github()
+_github_override = None
+
+# What we know about the copy of the DB sitting in DB_PATH. These live at module
+# level so every session in the Streamlit process shares them (the module is only
+# imported once, even though the page scripts rerun on every click).
+_remote_state = {
+    "etag": None,  # ETag GitHub sent with the last full download
+    "download_bytes": 0,  # size of that download on the wire (compressed, if it was a packed snapshot)
+    "sha": None,   # blob SHA of the remote file our local copy is based on (downloaded or uploaded)
+    "changes_etag": None,  # ETag of the last changes/ directory listing
+    "base_changesets": set(),  # changesets already contained in the DB file we downloaded
+    "installs": 0,  # downloads swapped in so far; a push checks it didn't change under its upload
+}
+
+# Downloads and uploads move through memory this much at a time, however big the DB is
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+UPLOAD_CHUNK_BYTES = 3 * 64 * 1024 # multiple of 3 so each chunk base64-encodes without padding
+
+# The backup API copies this many pages per step and lets writers in between steps
+SNAPSHOT_PAGES_PER_STEP = 256
+
+# Compressed snapshot format: a 16 byte header, then the compressed SQLite file.
+#   magic (6 bytes) | format version (1) | codec (1) | uncompressed size (8, big endian)
+# Anything that doesn't start with the magic is treated as a plain SQLite file, so
+# copies uploaded before this existed still download fine.
+SNAPSHOT_MAGIC = b"WCSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CODECS = {"gzip": 1, "zstd": 2}
+_SNAPSHOT_HEADER = struct.Struct(">6sBBQ")
+
+# A full upload that loses a race to another replica merges and tries again this
+# many times in total, waiting PUSH_BACKOFF_SECONDS, then twice that, and so on
+MAX_PUSH_ATTEMPTS = 4
+PUSH_BACKOFF_SECONDS = 0.5
+PUSH_BACKOFF_MAX_SECONDS = 8
+
+# Once this many changesets have piled up on top of the uploaded DB file, the next
+# pull uploads a fresh full copy so new replicas don't have to replay them all.
+COMPACT_AFTER_CHANGESETS = 100
+
+sync_stats = {
+    "downloads": 0,         # full-file downloads
+    "skips": 0,             # conditional requests answered with 304 Not Modified
+    "bytes_downloaded": 0,
+    "bytes_saved": 0,       # size of the last full download every time one was skipped
+    "changesets_pushed": 0,
+    "changesets_applied": 0,
+    "changesets_pruned": 0,  # changeset files deleted once a compacted DB file contained them
+    "bytes_pushed": 0,      # upload payload size, full pushes and changesets alike
+    "full_pushes": 0,
+    "push_conflicts": 0,    # uploads rejected because someone else uploaded first
+    "conflict_merges": 0,   # ...that we merged into and retried
+    "push_retries": 0,
+    "pushes_abandoned": 0,  # gave up after MAX_PUSH_ATTEMPTS
+}
+
+# ------ Write-behind push queue -------
+# Pages call request_sync() after a write and move on; a background thread does the
+# actual GitHub round trips. The outbox is the sync_changes table in the DB file,
+# so a push that fails (or a process that dies) leaves the changes there to retry.
+FLUSH_DELAY_SECONDS = 2        # wait for this much quiet so a burst of writes goes up as one push
+FLUSH_MAX_DELAY_SECONDS = 10   # ...but never sit on a write for longer than this
+RETRY_MAX_SECONDS = 300        # cap for the backoff between failed pushes
+
+# Held while a download is swapped in, and while a push reads the outbox or marks it
+# pushed, so the two can't shuffle the outbox under each other. Only ever held for
+# local work: never across an HTTP request or a sleep, so a page's download doesn't
+# wait on the flusher's upload.
+_sync_lock = threading.RLock()
+# Held for a whole push, retries and backoff included, so two pushes can't send the
+# same outbox. Downloads never take it.
+_push_lock = threading.RLock()
+
+_flusher = {
+    "thread": None,
+    "wakeup": threading.Condition(),
+    "first_request": None,  # monotonic time of the oldest write waiting for a push
+    "last_request": None,   # ...and of the newest one
+    "compact": False,       # next flush should upload the full DB file first
+    "retry_delay": 0,
+}
+
+flush_stats = {
+    "requests": 0,          # request_sync() calls
+    "flushes": 0,           # pushes that went through
+    "failed_flushes": 0,
+    "last_flush_ms": None,
+    "max_flush_ms": None,
+    "total_flush_ms": 0.0,
+    "last_error": None,
+}
 
 def get_db_path():
     return DB_PATH
 
-def download_db_from_github():
+def configure_github(settings):
+    """
+    Use these settings instead of st.secrets["github"], e.g. to point db_sync at
+    the fake contents API in benchmarks/fake_github.py. Pass None to go back.
+    """
+    global _github_override
+    _github_override = settings
+
+def _github_secrets():
+    return _github_override if _github_override is not None else st.secrets["github"]
+
+def _github_settings():
+    secrets = _github_secrets()
+    token = secrets["token"]
+    repo = secrets["repo"]
+    path = secrets["db_path"]
+    # Changesets go in a folder next to the DB file unless the secrets say otherwise
+    changes_path = secrets.get("changes_path", path + ".changes")
+    return token, repo, path, changes_path
+
+def _contents_url(repo, path):
+    api_url = _github_secrets().get("api_url", "https://api.github.com")
+    return f"{api_url}/repos/{repo}/contents/{path}"
+
+def get_snapshot_format():
+    """
+    How full DB uploads are stored on GitHub: "gzip" (default), "zstd" (needs the
+    zstandard package) or "raw". Downloads understand all three whatever this says.
+    """
+    snapshot_format = _github_secrets().get("snapshot_format", "gzip")
+    if snapshot_format == "zstd" and zstandard is None:
+        logger.warning("snapshot_format is zstd but zstandard isn't installed, using gzip")
+        return "gzip"
+    return snapshot_format
+
+def get_sync_mode():
+    """
+    "delta" (default) ships row-level changesets, "snapshot" uploads the whole DB
+    file after every write like we used to.
+    """
+    return _github_secrets().get("sync_mode", "delta")
+
+def _in_flusher():
+    return threading.current_thread() is _flusher["thread"]
+
+def _report_error(message):
+    # The flusher thread has no page to show an st.error on
+    if _in_flusher():
+        logger.warning(message)
+        flush_stats["last_error"] = message
+    else:
+        st.error(message)
+
+def _count(key, amount=1):
+    # Bump the process-wide counter and the one for the current browser session
+    sync_stats[key] += amount
+    if _in_flusher() or not st.runtime.exists():
+        return # no browser session to count against
+    try:
+        session_stats = st.session_state.setdefault("db_sync_stats", {})
+        session_stats[key] = session_stats.get(key, 0) + amount
+    except Exception:
+        pass # no session outside of a script run
+
+def get_sync_stats(session=False):
+    """
+    Returns a copy of the download counters plus the megabytes saved by skips.
+    With session=True only the counts for the current browser session are returned.
+    """
+    if session:
+        stats = {key: 0 for key in sync_stats}
+        stats.update(st.session_state.get("db_sync_stats", {}))
+    else:
+        stats = dict(sync_stats)
+    stats["mb_downloaded"] = round(stats["bytes_downloaded"] / (1024 * 1024), 3)
+    stats["mb_saved"] = round(stats["bytes_saved"] / (1024 * 1024), 3)
+    return stats
+
+def download_db_from_github(force=False):
     """
     Downloads the latest DB file from your private GitHub repo
     and saves it to /tmp/ for use by Streamlit.
+
+    If we already have a local copy we send the ETag from the last download with
+    If-None-Match, so GitHub answers 304 (no body) when the file hasn't changed
+    and we keep the copy we have. Pass force=True to always refetch.
     """
-    token = st.secrets["github"]["token"]
-    repo = st.secrets["github"]["repo"]
-    path = st.secrets["github"]["db_path"]
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
+    token, repo, path, changes_path = _github_settings()
+    url = _contents_url(repo, path)
 
     headers = {
         "Authorization": f"token {token}",
         "Accept": "application/vnd.github.v3.raw"
     }
 
-    r = requests.get(url, headers=headers)
-    if r.status_code == 200:
-        with open(DB_PATH, "wb") as f:
-            f.write(r.content)
+    have_local_copy = os.path.exists(DB_PATH)
+    if not force and have_local_copy and _remote_state["etag"]:
+        headers["If-None-Match"] = _remote_state["etag"]
+
+    r = http_client.get(url, headers=headers, stream=True)
+    if r.status_code == 304:
+        r.close()
+        _count("skips")
+        # What the 304 saved is the payload we'd have downloaded, not the unpacked
+        # file on disk, which is several times bigger for a compressed snapshot
+        _count("bytes_saved", _remote_state["download_bytes"])
+    elif r.status_code == 200:
+        import update_database # imported here, update_database imports this module
+
+        # Stream the body into a side file next to DB_PATH, a chunk at a time. Nothing
+        # touches DB_PATH until that file is complete and checked, so sessions keep
+        # reading the current copy the whole time.
+        try:
+            tmp_path, size = _stream_to_temp_file(r)
+            sha = _blob_sha(tmp_path) # of the file as GitHub stores it, before unpacking
+        except (requests.RequestException, OSError) as e:
+            _report_error(f"Failed to download DB: {e}")
+            return False
+
+        try:
+            _unpack_download(tmp_path)
+        except Exception as e: # bad header, truncated or corrupt stream
+            os.remove(tmp_path)
+            _report_error(f"Failed to unpack downloaded DB: {e}")
+            return False
+
+        if not _is_intact_db(tmp_path):
+            os.remove(tmp_path)
+            _report_error("Downloaded DB failed its integrity check, keeping the current copy")
+            return False
+
+        with _sync_lock:
+            _install_download(tmp_path, update_database)
+            _remote_state["etag"] = r.headers.get("ETag")
+            _remote_state["sha"] = sha
+            _remote_state["download_bytes"] = size
+            _count("downloads")
+            _count("bytes_downloaded", size)
+    else:
+        r.close()
+        _report_error(f"Failed to download DB: {r.status_code}")
+        return False
+
+    start_flusher() # picks up anything a previous run left in the outbox
+
+    if get_sync_mode() == "delta":
+        return pull_changes_from_github()
+    return True
+
+def _install_download(tmp_path, update_database):
+    """
+    Swaps a checked download in for DB_PATH, carrying our local changes across.
+    Call with _sync_lock held.
+    """
+    import db_connection
+
+    have_local_copy = os.path.exists(DB_PATH)
+
+    # Get the side file into the state it should be in before anyone can see it:
+    # sync tables present and anything we wrote that the downloaded copy doesn't
+    # have yet replayed on top, so the fresh copy doesn't silently drop it
+    try:
+        update_database.init_db(tmp_path) # the uploaded copy may predate the sync tables
+        base_changesets = update_database.get_applied_changesets(tmp_path)
+        last_seen, local_changes = 0, []
+        if have_local_copy:
+            with db_connection.connection() as conn:
+                last_seen = update_database.get_last_change_id(conn)
+                local_changes = update_database.get_unsynced_changes(conn, base_changesets)
+        # A full upload of ours that this copy doesn't contain was overwritten, so
+        # its changes go back in the outbox instead of counting as pushed
+        lost = [change for change in local_changes if (change["changeset_id"] or "").startswith("snapshot-")]
+        for change in lost:
+            change["changeset_id"] = None
+        update_database.replay_changes(local_changes, tmp_path)
+
+        # Queries wait while the file is swapped, and the pooled connections are
+        # closed so they reopen on the new copy instead of reading the old one
+        with db_connection.exclusive_access():
+            # Anything written between the replay above and now goes across too
+            if have_local_copy:
+                old_conn = sqlite3.connect(DB_PATH)
+                try:
+                    late = update_database.get_unsynced_changes(old_conn, base_changesets, last_seen)
+                finally:
+                    old_conn.close()
+                if late:
+                    update_database.replay_changes(late, tmp_path, clear_outbox=False)
+
+            os.replace(tmp_path, DB_PATH) # atomic on the same filesystem
+            update_database.invalidate_user_profile() # cached profiles came from the old file
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    _remote_state["base_changesets"] = base_changesets
+    _remote_state["changes_etag"] = None # re-check every changeset against the new copy
+    _remote_state["installs"] += 1
+    if lost:
+        request_sync()
+
+def _stream_to_temp_file(response):
+    """
+    Writes a streamed response into a temp file in the same folder as DB_PATH (so it
+    can be renamed over it) and returns (temp path, bytes written).
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(DB_PATH), prefix=".download-", suffix=".db")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    finally:
+        response.close()
+    return tmp_path, size
+
+def _blob_sha(path):
+    """The git blob SHA GitHub gives a file with these contents."""
+    digest = hashlib.sha1(b"blob %d\0" % os.path.getsize(path))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _is_intact_db(path):
+    """True if path is a complete SQLite file that passes PRAGMA quick_check."""
+    with open(path, "rb") as f:
+        if f.read(16) != b"SQLite format 3\x00":
+            return False
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+
+def _take_snapshot():
+    """
+    Copies DB_PATH into a temp file with SQLite's online backup API and returns
+    (snapshot path, snapshot id, changes it contains that were still in the outbox).
+
+    The backup reads a consistent state of the DB even while other sessions are
+    writing (it starts over if a write lands in the middle), so the snapshot never
+    has torn pages or a hot journal. The outbox is dropped from the copy (whoever
+    downloads it clears it anyway) and the copy is VACUUMed so we upload less.
+    The snapshot id is recorded as applied inside the copy, so a replica merging
+    against it later knows which of its changes the copy already has.
+    """
+    import update_database
+    import db_connection
+
+    snapshot_id = "snapshot-" + uuid.uuid4().hex
+    fd, snapshot_path = tempfile.mkstemp(dir=os.path.dirname(DB_PATH), prefix=".snapshot-", suffix=".db")
+    os.close(fd)
+    try:
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            with db_connection.connection() as source:
+                source.backup(snapshot, pages=SNAPSHOT_PAGES_PER_STEP)
+            pending = update_database.get_pending_changes(snapshot)
+            snapshot.execute("PRAGMA journal_mode=DELETE") # a single self-contained file
+            snapshot.execute("DELETE FROM sync_changes")
+            snapshot.execute("INSERT INTO sync_applied (changeset_id, applied_at) VALUES (?, ?)",
+                             (snapshot_id, datetime.now(timezone.utc).isoformat()))
+            snapshot.commit()
+            snapshot.execute("VACUUM")
+        finally:
+            snapshot.close()
+    except BaseException:
+        os.remove(snapshot_path)
+        raise
+    return snapshot_path, snapshot_id, pending
+
+def compress_snapshot(source_path, dest_path, codec="gzip"):
+    """Writes source_path to dest_path in the compressed snapshot format, streaming."""
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        dest.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_CODECS[codec],
+                                         os.path.getsize(source_path)))
+        if codec == "zstd":
+            with zstandard.ZstdCompressor(level=10).stream_writer(dest, closefd=False) as writer:
+                shutil.copyfileobj(source, writer, DOWNLOAD_CHUNK_BYTES)
+        else:
+            # mtime=0 so the same DB always compresses to the same bytes
+            with gzip.GzipFile(fileobj=dest, mode="wb", compresslevel=6, mtime=0) as writer:
+                shutil.copyfileobj(source, writer, DOWNLOAD_CHUNK_BYTES)
+
+def snapshot_codec(path):
+    """The codec name of a compressed snapshot, or None for a plain SQLite file."""
+    with open(path, "rb") as f:
+        header = f.read(_SNAPSHOT_HEADER.size)
+    if len(header) < _SNAPSHOT_HEADER.size or not header.startswith(SNAPSHOT_MAGIC):
+        return None
+    magic, version, codec_id, size = _SNAPSHOT_HEADER.unpack(header)
+    for name, known_id in SNAPSHOT_CODECS.items():
+        if known_id == codec_id:
+            return name
+    raise ValueError(f"Unknown snapshot codec {codec_id} (format version {version})")
+
+def decompress_snapshot(source_path, dest_path):
+    """Unpacks a compressed snapshot into a plain SQLite file, streaming."""
+    codec = snapshot_codec(source_path)
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        magic, version, codec_id, size = _SNAPSHOT_HEADER.unpack(source.read(_SNAPSHOT_HEADER.size))
+        if codec == "zstd":
+            if zstandard is None:
+                raise ValueError("Snapshot is zstd compressed but zstandard isn't installed")
+            with zstandard.ZstdDecompressor().stream_reader(source, closefd=False) as reader:
+                shutil.copyfileobj(reader, dest, DOWNLOAD_CHUNK_BYTES)
+        else:
+            with gzip.GzipFile(fileobj=source, mode="rb") as reader:
+                shutil.copyfileobj(reader, dest, DOWNLOAD_CHUNK_BYTES)
+    if os.path.getsize(dest_path) != size:
+        raise ValueError(f"Snapshot unpacked to {os.path.getsize(dest_path)} bytes, header says {size}")
+
+def _unpack_download(tmp_path):
+    # Downloads can be either format; turn a compressed one into a plain DB in place
+    if snapshot_codec(tmp_path) is None:
+        return
+    unpacked_path = tmp_path + ".unpacked"
+    try:
+        decompress_snapshot(tmp_path, unpacked_path)
+        os.replace(unpacked_path, tmp_path)
+    finally:
+        if os.path.exists(unpacked_path):
+            os.remove(unpacked_path)
+
+class _Base64JsonBody:
+    """
+    Request body for a contents API PUT that base64-encodes the file as it is sent,
+    so an upload never holds the whole DB (or its 1.33x bigger base64 copy) in memory.
+    requests streams it because it has read(), and __len__ gives it the Content-Length.
+    """
+
+    def __init__(self, path, fields):
+        head = json.dumps(fields)
+        self._prefix = (head[:-1] + ', "content": "').encode()
+        self._suffix = b'"}'
+        self._file = open(path, "rb")
+        self._remaining = os.path.getsize(path) # stick to this even if the file grows mid-upload
+        self.content_length = 4 * ((self._remaining + 2) // 3)
+        self._length = len(self._prefix) + self.content_length + len(self._suffix)
+        self._buffer = self._prefix
+        self._done = False
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._file.read(min(UPLOAD_CHUNK_BYTES, self._remaining))
+            self._remaining -= len(chunk)
+            if chunk:
+                self._buffer += base64.b64encode(chunk)
+            if not chunk or self._remaining == 0:
+                self._buffer += self._suffix
+                self._done = True
+                self._file.close()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(UPLOAD_CHUNK_BYTES)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._file.close()
+
+def pull_changes_from_github():
+    """
+    Applies changesets other replicas pushed since the DB file was uploaded.
+    The folder listing is fetched with If-None-Match, so when nobody has pushed
+    anything GitHub answers 304 and this costs no more than that one request.
+    """
+    import update_database
+
+    token, repo, path, changes_path = _github_settings()
+    url = _contents_url(repo, changes_path)
+
+    headers = {"Authorization": f"token {token}"}
+    if _remote_state["changes_etag"]:
+        headers["If-None-Match"] = _remote_state["changes_etag"]
+
+    r = http_client.get(url, headers=headers)
+    if r.status_code in (304, 404): # nothing new / nobody has pushed a changeset yet
+        return True
+    if r.status_code != 200:
+        _report_error(f"Failed to list DB changes: {r.status_code}")
+        return False
+
+    # Changeset names start with a UTC timestamp, so sorting by name applies them in order
+    listing = sorted((item for item in r.json() if item["name"].endswith(".json")), key=lambda item: item["name"])
+    applied = update_database.get_applied_changesets()
+
+    raw_headers = {"Authorization": f"token {token}", "Accept": "application/vnd.github.v3.raw"}
+    for item in listing:
+        changeset_id = item["name"][:-len(".json")]
+        if changeset_id in applied:
+            continue
+        cr = http_client.get(f"{url}/{item['name']}", headers=raw_headers)
+        if cr.status_code != 200:
+            _report_error(f"Failed to download DB change {changeset_id}: {cr.status_code}")
+            return False
+        _count("bytes_downloaded", len(cr.content))
+        if update_database.apply_changeset(changeset_id, json.loads(cr.content)["changes"]):
+            _count("changesets_applied")
+
+    _remote_state["changes_etag"] = r.headers.get("ETag")
+
+    # Fold the changesets back into the DB file once enough of them have piled up.
+    # That's a full upload, so leave it to the background flusher.
+    behind = [item for item in listing if item["name"][:-len(".json")] not in _remote_state["base_changesets"]]
+    if len(behind) >= COMPACT_AFTER_CHANGESETS:
+        _flusher["compact"] = True
+        request_sync()
+
+    return True
+
+def _prune_changesets(contained):
+    """
+    Deletes the changeset files that the DB file we just uploaded already contains.
+    GitHub lists at most 1,000 files in a folder, so if they were left there, replicas
+    would stop seeing new changesets once that many had piled up. A replica still on
+    the previous DB file gets these changes with the new file on its next download
+    check, since the file's ETag changed.
+    """
+    token, repo, path, changes_path = _github_settings()
+    url = _contents_url(repo, changes_path)
+    headers = {"Authorization": f"token {token}"}
+
+    r = http_client.get(url, headers=headers)
+    if r.status_code == 404:
+        return True
+    if r.status_code != 200:
+        _report_error(f"Failed to list DB changes for pruning: {r.status_code}")
+        return False
+
+    for item in r.json():
+        if not item["name"].endswith(".json") or item["name"][:-len(".json")] not in contained:
+            continue
+        data = {"message": f"Prune {item['name']}, it's in the DB file now", "sha": item["sha"]}
+        dr = http_client.delete(f"{url}/{item['name']}", headers=headers, json=data)
+        if dr.status_code not in (200, 404): # 404: another replica pruned it first
+            _report_error(f"Failed to prune DB change {item['name']}: {dr.status_code}")
+            return False
+        _count("changesets_pruned")
+    _remote_state["changes_etag"] = None
+    return True
+
+def push_changes_to_github():
+    """
+    Uploads the rows we changed since the last push as one small changeset file,
+    instead of the whole DB. Each changeset gets a new file name, so there is no
+    existing SHA to fetch first and two replicas pushing at once can't clash.
+    """
+    import update_database
+
+    with _push_lock:
+        return _push_changes(update_database)
+
+def _mark_pushed(update_database, pending, changeset_id, installs):
+    """
+    Stamps pending as pushed once its upload went through. installs is what
+    _remote_state["installs"] was when pending was read. Returns False if a
+    download was swapped in since; its replay gave the changes new ids, so they
+    are found by what they change instead. Call with _sync_lock held.
+    """
+    if installs == _remote_state["installs"]:
+        update_database.mark_changes_pushed([change["change_id"] for change in pending], changeset_id)
+        return True
+    update_database.mark_replayed_changes_pushed(pending, changeset_id)
+    return False
+
+def _push_changes(update_database):
+    with _sync_lock:
+        pending = update_database.get_pending_changes()
+        installs = _remote_state["installs"]
+    if not pending:
+        return True
+
+    token, repo, path, changes_path = _github_settings()
+    changeset_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + "-" + uuid.uuid4().hex[:8]
+    url = _contents_url(repo, f"{changes_path}/{changeset_id}.json")
+
+    body = json.dumps({
+        "id": changeset_id,
+        "changes": [
+            {key: change[key] for key in ("table_name", "op", "row_key", "payload", "created_at")}
+            for change in pending
+        ],
+    }).encode()
+
+    data = {
+        "message": f"Sync {len(pending)} change(s) from Streamlit app",
+        "content": base64.b64encode(body).decode(),
+    }
+    r = http_client.put(url, headers={"Authorization": f"token {token}"}, json=data)
+    if r.status_code in (200, 201):
+        with _sync_lock:
+            _mark_pushed(update_database, pending, changeset_id, installs)
+        _count("changesets_pushed")
+        _count("bytes_pushed", len(data["content"]))
         return True
     else:
-        st.error(f"Failed to download DB: {r.status_code}")
+        _report_error(f"❌ Failed to push DB changes: {r.status_code}")
         return False
 
+def sync_db_to_github():
+    """
+    Pushes the outbox right now, the way get_sync_mode() says to. Pages should
+    call request_sync() instead so they don't wait on GitHub.
+    """
+    if get_sync_mode() == "snapshot":
+        return push_db_to_github()
+    return push_changes_to_github()
+
+def request_sync():
+    """
+    Call after a write. Returns straight away; the background flusher pushes once
+    writes have been quiet for FLUSH_DELAY_SECONDS (or FLUSH_MAX_DELAY_SECONDS
+    after the first one at the latest), so a burst from any page is one push.
+    """
+    start_flusher()
+    with _flusher["wakeup"]:
+        now = time.monotonic()
+        if _flusher["first_request"] is None:
+            _flusher["first_request"] = now
+        _flusher["last_request"] = now
+        flush_stats["requests"] += 1
+        _flusher["wakeup"].notify()
+
+def start_flusher():
+    """Starts the background push thread once per process."""
+    with _flusher["wakeup"]:
+        if _flusher["thread"] is not None and _flusher["thread"].is_alive():
+            return
+        _flusher["thread"] = threading.Thread(target=_flush_loop, name="db-sync-flusher", daemon=True)
+        _flusher["thread"].start()
+
+def _flush_loop():
+    import update_database
+
+    # Whatever is still in the outbox from before this process started goes up first
+    if update_database.count_pending_changes():
+        with _flusher["wakeup"]:
+            if _flusher["first_request"] is None:
+                _flusher["first_request"] = _flusher["last_request"] = time.monotonic()
+
+    while True:
+        with _flusher["wakeup"]:
+            while _flusher["first_request"] is None:
+                _flusher["wakeup"].wait()
+            while True:
+                deadline = min(_flusher["last_request"] + FLUSH_DELAY_SECONDS,
+                               _flusher["first_request"] + FLUSH_MAX_DELAY_SECONDS)
+                deadline = max(deadline, _flusher["first_request"] + _flusher["retry_delay"])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _flusher["wakeup"].wait(remaining)
+            _flusher["first_request"] = _flusher["last_request"] = None
+
+        start = time.perf_counter()
+        try:
+            ok = True
+            if _flusher["compact"]:
+                ok = push_db_to_github()
+                if ok:
+                    _flusher["compact"] = False
+                    # Best effort: whatever isn't pruned now goes with the next compaction
+                    _prune_changesets(_remote_state["base_changesets"])
+            ok = ok and sync_db_to_github()
+        except Exception as e: # network errors etc. - the outbox is still there, try again
+            _report_error(f"DB sync failed: {e}")
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        flush_stats["last_flush_ms"] = round(elapsed_ms, 1)
+        flush_stats["max_flush_ms"] = round(max(elapsed_ms, flush_stats["max_flush_ms"] or 0), 1)
+        flush_stats["total_flush_ms"] += elapsed_ms
+
+        with _flusher["wakeup"]:
+            if ok:
+                flush_stats["flushes"] += 1
+                _flusher["retry_delay"] = 0
+            else:
+                flush_stats["failed_flushes"] += 1
+                _flusher["retry_delay"] = min(max(_flusher["retry_delay"] * 2, FLUSH_DELAY_SECONDS), RETRY_MAX_SECONDS)
+                if _flusher["first_request"] is None:
+                    _flusher["first_request"] = _flusher["last_request"] = time.monotonic()
+
+def get_flush_stats():
+    """
+    Queue depth (unpushed changes in the outbox) and push latency for the debug panel.
+    """
+    import update_database
+
+    stats = dict(flush_stats)
+    attempts = stats["flushes"] + stats["failed_flushes"]
+    stats["avg_flush_ms"] = round(stats.pop("total_flush_ms") / attempts, 1) if attempts else None
+    stats["queue_depth"] = update_database.count_pending_changes()
+    stats["waiting_to_flush"] = _flusher["first_request"] is not None
+    stats["retry_delay_s"] = _flusher["retry_delay"]
+    return stats
+
 def push_db_to_github():
     """
     Encodes and uploads the updated DB back to the GitHub repo.
+
+    The upload sends the SHA of the remote file our copy is based on, so if another
+    replica uploaded since we downloaded, GitHub rejects it. Rather than overwrite
+    their upload, we download it, merge our row changes into it
+    (food_journal rows by entry_id, users by email), and try again, backing off a
+    little more each time, up to MAX_PUSH_ATTEMPTS.
     """
-    token = st.secrets["github"]["token"]
-    repo = st.secrets["github"]["repo"]
-    path = st.secrets["github"]["db_path"]
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
+    import update_database
+
+    with _push_lock:
+        for attempt in range(MAX_PUSH_ATTEMPTS):
+            if attempt:
+                _count("push_retries")
+                # Jittered so replicas that collided don't collide again. Pages can
+                # download and swap in a new copy while we wait.
+                time.sleep(min(PUSH_BACKOFF_SECONDS * 2 ** (attempt - 1), PUSH_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.5))
+
+            result = _push_db(update_database)
+            if result != "conflict":
+                return result
+
+            _count("push_conflicts")
+            if attempt + 1 < MAX_PUSH_ATTEMPTS:
+                # Merge our changes into what's up there now, then upload that
+                if not download_db_from_github(force=True):
+                    return False
+                _count("conflict_merges")
 
-    with open(DB_PATH, "rb") as f:
-        content = base64.b64encode(f.read()).decode()
+        _count("pushes_abandoned")
+        _report_error(f"❌ Failed to push DB: still conflicting after {MAX_PUSH_ATTEMPTS} attempts")
+        return False
+
+def _push_db(update_database):
+    """One upload attempt. Returns True, False, or "conflict" when our SHA is stale."""
+    token, repo, path, changes_path = _github_settings()
+    url = _contents_url(repo, path)
 
-    # Get existing file SHA to overwrite
+    # We overwrite the remote file only if it's still the one our copy came from, so
+    # GitHub gets that SHA, not the current one. Checking it first saves taking and
+    # uploading a snapshot that GitHub would only reject.
     headers = {"Authorization": f"token {token}"}
-    r = requests.get(url, headers=headers)
+    r = http_client.get(url, headers=headers)
     if r.status_code != 200:
-        st.error(f"Failed to fetch existing DB info: {r.status_code}")
+        _report_error(f"Failed to fetch existing DB info: {r.status_code}")
         return False
+    remote_sha = r.json()["sha"]
 
-    sha = r.json()["sha"]
+    # Upload a consistent copy rather than the live file other sessions are writing to.
+    # The snapshot and the SHA it's based on are read together, so a download swapped
+    # in around them can't pair one file's contents with another's SHA.
+    with _sync_lock:
+        if remote_sha != _remote_state["sha"]:
+            return "conflict" # someone uploaded since we downloaded (or we never have)
+        installs = _remote_state["installs"]
+        snapshot_path, snapshot_id, pending = _take_snapshot()
+    uploaded_changesets = update_database.get_applied_changesets(snapshot_path)
 
     data = {
         "message": "Update wellesley_crave.db from Streamlit app",
-        "content": content,
-        "sha": sha
+        "sha": remote_sha
     }
+    snapshot_format = get_snapshot_format()
+    if snapshot_format != "raw":
+        compressed_path = snapshot_path + "." + snapshot_format
+        try:
+            compress_snapshot(snapshot_path, compressed_path, snapshot_format)
+        finally:
+            os.remove(snapshot_path)
+        snapshot_path = compressed_path
+    body = _Base64JsonBody(snapshot_path, data) # "content" is filled in as the upload goes
 
     put_headers = {
-        "Authorization": f"token {token}"
+        "Authorization": f"token {token}",
+        "Content-Type": "application/json"
     }
 
-    r = requests.put(url, headers=put_headers, json=data)
+    try:
+        r = http_client.put(url, headers=put_headers, data=body)
+    finally:
+        body.close()
+        os.remove(snapshot_path)
     if r.status_code in (200, 201):
+        with _sync_lock:
+            # Everything in the outbox went up inside the file, no need to send it again
+            if _mark_pushed(update_database, pending, snapshot_id, installs):
+                # The remote file is now exactly our local copy. GitHub doesn't hand back
+                # the raw ETag on a PUT, so forget the old one: the next download
+                # refetches once and picks up the new ETag.
+                _remote_state["sha"] = r.json()["content"]["sha"]
+                _remote_state["etag"] = None
+                _remote_state["base_changesets"] = uploaded_changesets
+            # Otherwise the download swapped in during the upload already set these
+            # for the file it installed; if that's older than ours, the next push
+            # finds out from the SHA and merges
+        _count("full_pushes")
+        _count("bytes_pushed", body.content_length)
         # st.success("✅ DB pushed back to private repo.")
         return True
+    elif r.status_code in (409, 422):
+        # 409: the file changed since we read its SHA. 422: it was created in between.
+        return "conflict"
     else:
-        st.error(f"❌ Failed to push DB: {r.status_code}")
-        return False
\ No newline at end of file
+        _report_error(f"❌ Failed to push DB: {r.status_code}")
+        return False
@@ -0,0 +1,57 @@
+import ast
+
+# The allergens and dietary restrictions users can pick, as stored in the DB: a
+# user's choices are one integer per list, with bit i set if they picked item i.
+# Bit positions are saved in every DB file, so only ever append to these lists.
+ALLERGENS = ["Peanut", "Soy", "Dairy", "Egg", "Wheat", "Sesame", "Shellfish", "Fish", "Tree Nut"]
+RESTRICTIONS = ["Vegetarian", "Vegan", "Gluten Sensitive", "Halal", "Kosher", "Lactose-Intolerant"]
+
+ALLERGEN_BITS = {name: 1 << i for i, name in enumerate(ALLERGENS)}
+RESTRICTION_BITS = {name: 1 << i for i, name in enumerate(RESTRICTIONS)}
+
+def encode(names, bits):
+    """Mask for a list of names; names that aren't in the vocabulary are ignored."""
+    mask = 0
+    for name in names:
+        mask |= bits.get(name, 0)
+    return mask
+
+def decode(mask, vocabulary):
+    """Names whose bits are set in mask, in vocabulary order."""
+    return [name for i, name in enumerate(vocabulary) if mask >> i & 1]
+
+def encode_allergens(names):
+    return encode(names, ALLERGEN_BITS)
+
+def decode_allergens(mask):
+    return decode(mask or 0, ALLERGENS)
+
+def encode_restrictions(names):
+    return encode(names, RESTRICTION_BITS)
+
+def decode_restrictions(mask):
+    return decode(mask or 0, RESTRICTIONS)
+
+def parse_legacy_list(text):
+    """The old text columns held str(list) (walkthrough) or JSON (settings); both parse as Python literals."""
+    if not text:
+        return []
+    try:
+        value = ast.literal_eval(text)
+    except (SyntaxError, ValueError):
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def dish_masks(dish):
+    """(allergen mask, restriction mask) for a dish from the menu API."""
+    return (encode((a["name"] for a in dish.get("allergens") or []), ALLERGEN_BITS),
+            encode((p["name"] for p in dish.get("preferences") or []), RESTRICTION_BITS))
+
+def dish_allowed(dish_allergen_mask, dish_restriction_mask, user_allergen_mask, user_restriction_mask):
+    """
+    False if the dish has any of the user's allergens, or the user has
+    restrictions and the dish is labelled with none of them.
+    """
+    if dish_allergen_mask & user_allergen_mask:
+        return False
+    return not user_restriction_mask or bool(dish_restriction_mask & user_restriction_mask)
@@ -4,16 +4,19 @@ from user_profile import render_user_profile
 import datetime
 from zoneinfo import ZoneInfo
 import pandas as pd
-import requests
+import http_client
+import menus
+from menus import MENU_IDS
 from user_profile import get_user_info
-from db_sync import download_db_from_github
+from db_sync import download_db_from_github, get_sync_stats, get_flush_stats
+from db_connection import get_connection_stats
 from userWalkthrough import newUser
 from update_database import checkNewUser
 from update_database import init_db
 from update_database import getUserFavDiningHall
 from notification import check_favorites_available
-import ast
-from update_database import fetch_user_info
+from update_database import get_user_dietary_masks
+from update_database import get_profile_cache_stats
 
 
 # -- Prof. Eni code start -- #
@@ -31,6 +34,9 @@ user = get_user_info(access_token)
 
 
 def render_sidebar():
+    # Every page calls this, so it's where the process-wide menu prefetcher gets started
+    menus.start_prefetcher()
+
     #URLs for the images used in the sidebar
     blank_square = "https://i.imgur.com/3Th4rvF.png"
     sidebar_image_url = "https://i.imgur.com/oyBooq2.jpeg"
@@ -83,6 +89,19 @@ def render_sidebar():
         unsafe_allow_html=True,
     )
 
+    if DEBUG:
+        with st.sidebar.expander("Debug: DB sync"):
+            st.write("This session", get_sync_stats(session=True))
+            st.write("All sessions", get_sync_stats())
+            st.write("Push queue", get_flush_stats())
+            st.write("SQLite connections", get_connection_stats())
+            st.write("User profile cache", get_profile_cache_stats())
+        with st.sidebar.expander("Debug: HTTP"):
+            st.write(http_client.get_latency_stats())
+        with st.sidebar.expander("Debug: menu cache"):
+            st.write(menus.get_menu_cache_stats())
+            st.write("Prefetch", menus.get_prefetch_stats())
+
     if "access_token" in st.session_state:
         render_user_profile()
 
@@ -98,21 +117,8 @@ def render_sidebar():
             st.rerun()
 
 
-# This data can also be in a CSV file and then directly loaded from the file
-data = [
-    {'location': 'Bae', 'meal': 'Breakfast', 'locationID': 96, 'mealID': 148},
-    {'location': 'Bae', 'meal': 'Lunch', 'locationID': 96, 'mealID': 149},
-    {'location': 'Bae', 'meal': 'Dinner', 'locationID': 96, 'mealID': 312},
-    {'location': 'Bates', 'meal': 'Breakfast', 'locationID': 95, 'mealID': 145},
-    {'location': 'Bates', 'meal': 'Lunch', 'locationID': 95, 'mealID': 146},
-    {'location': 'Bates', 'meal': 'Dinner', 'locationID': 95, 'mealID': 311},
-    {'location': 'Stone D', 'meal': 'Breakfast', 'locationID': 131, 'mealID': 261},
-    {'location': 'Stone D', 'meal': 'Lunch', 'locationID': 131, 'mealID': 262},
-    {'location': 'Stone D', 'meal': 'Dinner', 'locationID': 131, 'mealID': 263},
-    {'location': 'Tower', 'meal': 'Breakfast', 'locationID': 97, 'mealID': 153},
-    {'location': 'Tower', 'meal': 'Lunch', 'locationID': 97, 'mealID': 154},
-    {'location': 'Tower', 'meal': 'Dinner', 'locationID': 97, 'mealID': 310},
-]
+# The hall/meal IDs live in menus.py now
+data = MENU_IDS
 # Create a dataframe to make it easy to look up the IDs
 dfKeys = pd.DataFrame(data)
 
@@ -132,33 +138,8 @@ def get_params(df, loc, meal):
 # Kaurvaki code #
 # Functions
 def get_menu(date, locationID, mealID):
-    base_url = "https://dish.avifoodsystems.com/api/menu-items/week"
-
-    params = {"date" : date, "locationID" : locationID, "mealID" : mealID}
-
-    response = requests.get(base_url, params = params)
-
-    fullUrl = response.url
-
-    data = requests.get(fullUrl).json()
-
-    # New code we are adding
-    result = pd.DataFrame(data)
-
-    return result
-
-def transform(cell):
-    result = ""
-    if cell:
-        # result is a string where each allergen in the list in the cell is brought together
-        result = ",".join([item["name"] for item in cell])
-    return result
-
-def dropKeys(cell):
-    cell.pop("id")
-    cell.pop("corporateProductId")
-    cell.pop("caloriesFromSatFat")
-    return cell
+    # That day's menu, one cached fetch (menus.py), cleaned into one row per dish
+    return menus.normalize_menu(menus.get_menu_items(date, locationID, mealID))
 
 def greeting_Menu():
     # Greeting at Top of Page
@@ -227,66 +208,26 @@ def homePage(): # only show once user has walkthrough!
 
     df = get_menu(formattedDate, location_id, meal_id) # d is date
 
-    # We only want today's menu... not the whole week
-    # format of date data in df: 2025-04-14T00:00:00
-    # Source for strftime - https://www.geeksforgeeks.org/python-strftime-function/
-
-    today = d.strftime("%Y") + "-" + d.strftime("%m") + "-" + d.strftime("%d") + "T00:00:00"
-    
-    df = df[df["date"] == today]  # only today's meals
+    # get_menu only returns today's menu, already cleaned (menus.normalize_menu)
 
     # Aileen's Code
     if df.empty:
         st.warning(f"No menu available for {userMeal} at {userDiningHall} today.")
         return  # Exit early so nothing else runs
 
-    # cleaning up df - Kaurvaki - lot of code from own Assignment 5 of CS248
-    df = df.drop_duplicates(subset=["id"], keep="first")
-    df = df.drop(columns=["image", "id", "categoryName", "stationOrder", "price"], errors="ignore")
-
-    df["allergens"] = df["allergens"].apply(transform) # for the allergens column, it goes through each row and turn them into a string
-    df["preferences"] = df["preferences"].apply(transform)
-    df["nutritionals"] = df["nutritionals"].apply(dropKeys)
-
-    colNames = df.iloc[0].nutritionals.keys()
-    for key in colNames:
-        if key == "servingSizeUOM":
-            df[key] = df["nutritionals"].apply(lambda dct: str(dct["servingSizeUOM"]))
-        else:
-            df[key] = df["nutritionals"].apply(lambda dct: float(dct[key]))
-
-    df = df.drop("nutritionals", axis=1)
-
-
     # Menu Title and Info.
     st.subheader(userMeal + " Today at " + userDiningHall)
 
     with st.container(border = True):
-        user_record = fetch_user_info(user["email"]) # Aileen's code from food_journal.py
-        user_allergens = [] # Aileen's code from food_journal.py
-        # user_preferences = [] not enough time to look into dietary restrictions/preferences
-
-        if user_record: # Kaurvaki pulled Aileen's code from food_journal.py
-            try:
-                # ******ast library and method 
-                user_allergens = ast.literal_eval(user_record[3]) if user_record[3] else []
-                user_preferences = ast.literal_eval(user_record[4]) if user_record[4] else []
-            except Exception as e:
-                st.warning("Could not parse stored user allergies/preferences.")
+        # Bitmasks over dietary.ALLERGENS / dietary.RESTRICTIONS, so filtering a dish is a bitwise AND
+        user_allergen_mask, user_restriction_mask = get_user_dietary_masks(user["email"])
 
         apply_custom_filter = st.checkbox("Apply my saved allergy and dietary preferences to filter menu") # Aileen's code from food_journal.py
 
-        # Aileen's Code
-        params = {
-        "date": d.strftime("%m-%d-%Y"),
-        "locationID": location_id,
-        "mealID": meal_id
-        }
-
-        r = requests.get("https://dish.avifoodsystems.com/api/menu-items", params=params)
-        items = r.json()
+        # Aileen's Code - the rows come from the same df as the check above, no second fetch
+        shown = menus.allowed_dishes(df, user_allergen_mask, user_restriction_mask) if apply_custom_filter else df
 
-        if items:
+        if not df.empty:
             st.subheader(f"{userMeal} at {userDiningHall}")
             header = st.columns(6)
             header[0].markdown("**Dish**")
@@ -299,33 +240,22 @@ def homePage(): # only show once user has walkthrough!
         if 'selected_dishes' not in st.session_state:
             st.session_state['selected_dishes'] = []
 
-        for i, dish in enumerate(items): # Aileen's code from food_journal.py
+        # i is the dish's row in the full menu, so checkbox keys don't change when the filter is toggled
+        for i, dish in zip(shown.index, shown.to_dict("records")): # Aileen's code from food_journal.py
             name = dish.get("name", "")
 
-            # explain a['name']
-            allergies = [a['name'] for a in dish.get("allergens", [])]
-
-            preferences = [p['name'] for p in dish.get("preferences", [])]
-            
-            if apply_custom_filter:
-                if any(allergen in user_allergens for allergen in allergies):
-                    continue
-                if user_preferences and not any(pref in preferences for pref in user_preferences):
-                    continue
-
-            nutrition = dish.get("nutritionals", {})
-            nutrition = dropKeys(nutrition) if nutrition else {}
-            calories = nutrition.get("calories", 0.0)
-            protein = nutrition.get("protein", 0.0)
-            carbs = nutrition.get("carbohydrates", 0.0)
-            fat = nutrition.get("fat", 0.0)
+            # float32 columns; rounded so 12.3 doesn't come out as 12.300000190734863
+            calories = round(float(dish.get("calories", 0.0)), 2)
+            protein = round(float(dish.get("protein", 0.0)), 2)
+            carbs = round(float(dish.get("carbohydrates", 0.0)), 2)
+            fat = round(float(dish.get("fat", 0.0)), 2)
 
             row = st.columns(6)  
             row[0].write(name)
-            row[1].write(f"{calories} cal")
-            row[2].write(f"{protein} g")
-            row[3].write(f"{fat} g")
-            row[4].write(f"{carbs} g")
+            row[1].write(f"{calories:g} cal")
+            row[2].write(f"{protein:g} g")
+            row[3].write(f"{fat:g} g")
+            row[4].write(f"{carbs:g} g")
             checked = row[5].checkbox("", key=f"add_{userMeal}_{name}_{i}")
             if checked and name not in [x['name'] for x in st.session_state['selected_dishes']]:
                 st.session_state['selected_dishes'].append({
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One requests.Session for the whole Streamlit process, so every page, session and
+# background thread reuses the same keep-alive connections instead of paying a new
+# TCP + TLS handshake on each call.
+CONNECT_TIMEOUT = 3.05  # seconds to open a connection
+READ_TIMEOUT = 20       # seconds to wait between bytes of the response
+POOL_HOSTS = 10         # how many hosts keep a connection pool (GitHub, AVI, Google...)
+POOL_MAXSIZE = 16       # open connections kept per host
+
+# GETs that fail to connect or come back 429/5xx are retried with backoff. PUTs aren't
+# retried here: the GitHub upload body is a one-shot stream, and db_sync has its own
+# retry logic for pushes.
+RETRIES = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    status=3,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+LATENCY_SAMPLES = 200 # recent requests per host kept for the percentiles
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_host_stats = {}
+
+def get_session():
+    """The process-wide session, created on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=RETRIES)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _record(host, elapsed_ms, failed):
+    with _stats_lock:
+        stats = _host_stats.setdefault(host, {
+            "requests": 0,
+            "errors": 0,
+            "samples": deque(maxlen=LATENCY_SAMPLES),
+        })
+        stats["requests"] += 1
+        if failed:
+            stats["errors"] += 1
+        else:
+            stats["samples"].append(elapsed_ms)
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Same as requests.request, but through the shared session, with default
+    timeouts and per-host latency tracking.
+    """
+    host = urlsplit(url).netloc
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+    except requests.RequestException:
+        _record(host, (time.perf_counter() - start) * 1000, failed=True)
+        raise
+    _record(host, (time.perf_counter() - start) * 1000, failed=response.status_code >= 500)
+    return response
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+def get_latency_stats():
+    """Request count, error count and p50/p95/max latency (ms) per host."""
+    report = {}
+    with _stats_lock:
+        for host, stats in _host_stats.items():
+            samples = sorted(stats["samples"])
+            def percentile(p):
+                return round(samples[min(len(samples) - 1, int(p * len(samples)))], 1) if samples else None
+            report[host] = {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "max_ms": round(samples[-1], 1) if samples else None,
+            }
+    return report
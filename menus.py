@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date as date_type, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import dietary
+import http_client
+from db_connection import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Every page gets AVI menus through get_menu_items, which reads through a SQLite
+# cache keyed by (date, locationID, mealID). The cache is its own file rather than
+# a table in the app DB: menus are public data we can always fetch again, so
+# there's no point shipping them to GitHub with every sync. Every session and every
+# app process on this machine shares the file, and it outlives restarts.
+MENU_URL = "https://dish.avifoodsystems.com/api/menu-items"
+MENU_CACHE_PATH = os.environ.get("WELLESLEY_CRAVE_MENU_CACHE_PATH", "/tmp/wellesley_crave_menus.db")
+
+# Moved here from home.py (and notification.py's copy of it)
+MENU_IDS = [
+    {'location': 'Bae', 'meal': 'Breakfast', 'locationID': 96, 'mealID': 148},
+    {'location': 'Bae', 'meal': 'Lunch', 'locationID': 96, 'mealID': 149},
+    {'location': 'Bae', 'meal': 'Dinner', 'locationID': 96, 'mealID': 312},
+    {'location': 'Bates', 'meal': 'Breakfast', 'locationID': 95, 'mealID': 145},
+    {'location': 'Bates', 'meal': 'Lunch', 'locationID': 95, 'mealID': 146},
+    {'location': 'Bates', 'meal': 'Dinner', 'locationID': 95, 'mealID': 311},
+    {'location': 'Stone D', 'meal': 'Breakfast', 'locationID': 131, 'mealID': 261},
+    {'location': 'Stone D', 'meal': 'Lunch', 'locationID': 131, 'mealID': 262},
+    {'location': 'Stone D', 'meal': 'Dinner', 'locationID': 131, 'mealID': 263},
+    {'location': 'Tower', 'meal': 'Breakfast', 'locationID': 97, 'mealID': 153},
+    {'location': 'Tower', 'meal': 'Lunch', 'locationID': 97, 'mealID': 154},
+    {'location': 'Tower', 'meal': 'Dinner', 'locationID': 97, 'mealID': 310},
+]
+MEAL_BY_ID = {info["mealID"]: info["meal"] for info in MENU_IDS}
+
+# Hours (Eastern, inclusive) each meal is served, same as home.greeting_Menu
+TIMEZONE = ZoneInfo("America/New_York")
+MEAL_WINDOWS = {
+    "Breakfast": (1, 10),
+    "Lunch": (11, 16),
+    "Dinner": (17, 23),
+}
+
+# How long a cached menu is good for. A meal that's been served won't change, so
+# past days (and today's finished meals) never go stale. While a meal is being
+# served the dining hall can still swap dishes, so it's checked often; menus for
+# later meals are checked a few times a day. An empty menu for today or later
+# usually means it hasn't been published yet, so it's retried soon.
+FRESH_DURING_MEAL = 15 * 60
+FRESH_BEFORE_MEAL = 2 * 60 * 60
+FRESH_IF_EMPTY = 15 * 60
+
+# fetch_menus fetches this many menus from AVI at once (the http_client pool keeps
+# as many connections per host open), gives each request MENU_FETCH_TIMEOUT and
+# stops waiting for the whole batch after MENU_FETCH_DEADLINE seconds.
+MENU_FETCH_CONCURRENCY = http_client.POOL_MAXSIZE
+MENU_FETCH_TIMEOUT = (http_client.CONNECT_TIMEOUT, 10)
+MENU_FETCH_DEADLINE = 20
+
+menu_cache_stats = {
+    "hits": 0,
+    "misses": 0,            # nothing cached for the key
+    "stale": 0,             # cached, but past its freshness, so fetched again
+    "stale_served": 0,      # ...and the fetch failed, so the old copy was used
+    "upstream_requests": 0,
+    "upstream_errors": 0,
+}
+LATENCY_SAMPLES = 200
+_upstream_ms = deque(maxlen=LATENCY_SAMPLES)
+_stats_lock = threading.Lock()
+
+def _count(key):
+    with _stats_lock:
+        menu_cache_stats[key] += 1
+
+def _create_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS menu_cache (
+            date TEXT NOT NULL,
+            location_id INTEGER NOT NULL,
+            meal_id INTEGER NOT NULL,
+            items TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (date, location_id, meal_id)
+        )
+    ''')
+
+# Lent per query like the app DB's connections, not kept per thread
+_pool = ConnectionPool(lambda: MENU_CACHE_PATH, setup=_create_table)
+
+def _as_date(day):
+    """Accepts a date, a datetime or the API's MM-DD-YYYY string."""
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date_type):
+        return day
+    return datetime.strptime(day, "%m-%d-%Y").date()
+
+def freshness_seconds(day, meal_id, item_count, now=None):
+    """How long a menu fetched `now` stays fresh; None means for good."""
+    now = now or datetime.now(TIMEZONE)
+    today = now.date()
+    if day < today:
+        return None
+    if item_count == 0:
+        return FRESH_IF_EMPTY
+    start, end = MEAL_WINDOWS.get(MEAL_BY_ID.get(meal_id), (0, 23))
+    if day == today:
+        if now.hour > end:
+            return None
+        if now.hour >= start:
+            return FRESH_DURING_MEAL
+    return FRESH_BEFORE_MEAL
+
+def _expires_at(day, meal_id, item_count, fetched_at):
+    """Unix time a cached menu goes stale, or None if it never does."""
+    # Judged as of the fetch: a menu fetched before its meal ended isn't final
+    # just because the meal has ended since
+    fresh_for = freshness_seconds(day, meal_id, item_count, datetime.fromtimestamp(fetched_at, TIMEZONE))
+    return None if fresh_for is None else fetched_at + fresh_for
+
+def _is_fresh(day, meal_id, items, fetched_at):
+    expires_at = _expires_at(day, meal_id, len(items), fetched_at)
+    return expires_at is None or time.time() < expires_at
+
+def _fetch(day, location_id, meal_id, timeout=None):
+    params = {"date": day.strftime("%m-%d-%Y"), "locationID": location_id, "mealID": meal_id}
+    start = time.perf_counter()
+    try:
+        r = http_client.get(MENU_URL, params=params, timeout=timeout)
+        r.raise_for_status()
+        items = r.json()
+    except Exception:
+        _count("upstream_errors")
+        raise
+    finally:
+        _count("upstream_requests")
+        with _stats_lock:
+            _upstream_ms.append((time.perf_counter() - start) * 1000)
+    return items
+
+def store_menus(menus, fetched_at=None):
+    """Caches {(day, location_id, meal_id): items, ...} in one transaction."""
+    fetched_at = time.time() if fetched_at is None else fetched_at
+    with _pool.checkout() as conn, conn:
+        conn.executemany('''
+            INSERT INTO menu_cache (date, location_id, meal_id, items, fetched_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (date, location_id, meal_id) DO UPDATE SET items = excluded.items, fetched_at = excluded.fetched_at
+        ''', [(_as_date(day).isoformat(), int(location_id), int(meal_id), json.dumps(items), fetched_at)
+              for (day, location_id, meal_id), items in menus.items()])
+
+def store_menu(day, location_id, meal_id, items, fetched_at=None):
+    store_menus({(day, location_id, meal_id): items}, fetched_at)
+
+def _lookup(day, location_id, meal_id):
+    """(cached items or None, whether they're fresh), counting the hit or miss."""
+    with _pool.checkout() as conn:
+        row = conn.execute(
+            "SELECT items, fetched_at FROM menu_cache WHERE date = ? AND location_id = ? AND meal_id = ?",
+            (day.isoformat(), int(location_id), int(meal_id))).fetchone()
+    if row is None:
+        _count("misses")
+        return None, False
+    cached = json.loads(row[0])
+    fresh = _is_fresh(day, int(meal_id), cached, row[1])
+    _count("hits" if fresh else "stale")
+    return cached, fresh
+
+def get_menu_items(day, location_id, meal_id):
+    """
+    The menu-items list for one hall and meal on day (a date or "MM-DD-YYYY"),
+    from the cache if it's fresh, otherwise from AVI. If AVI fails and there's an
+    old copy, the old copy is returned; with no copy the error is raised.
+    """
+    day = _as_date(day)
+    cached, fresh = _lookup(day, location_id, meal_id)
+    if fresh:
+        return cached
+
+    try:
+        items = _fetch(day, location_id, meal_id)
+    except Exception:
+        if cached is None:
+            raise
+        _count("stale_served")
+        return cached
+    store_menu(day, location_id, meal_id, items)
+    return items
+
+def fetch_menus(keys, max_workers=None, timeout=None, deadline=None):
+    """
+    get_menu_items for many (day, locationID, mealID) keys at once: fresh menus
+    come from the cache, the rest are fetched from AVI on up to max_workers
+    threads (the MENU_FETCH_* settings above unless given).
+    Returns (menus, failures). menus maps every key that has a menu to its items
+    (a stale copy if the fetch failed); failures maps the keys that have nothing
+    to the exception, a TimeoutError if the deadline passed first.
+    """
+    max_workers = max_workers or MENU_FETCH_CONCURRENCY
+    timeout = timeout or MENU_FETCH_TIMEOUT
+    deadline = deadline or MENU_FETCH_DEADLINE
+
+    menus, failures, stale, pending = {}, {}, {}, []
+    for key in dict.fromkeys(keys):
+        day, location_id, meal_id = _as_date(key[0]), key[1], key[2]
+        cached, fresh = _lookup(day, location_id, meal_id)
+        if fresh:
+            menus[key] = cached
+            continue
+        if cached is not None:
+            stale[key] = cached
+        pending.append((key, day, location_id, meal_id))
+    if not pending:
+        return menus, failures
+
+    fetched, errors = _fetch_concurrently(pending, max_workers, timeout, deadline)
+    menus.update(fetched)
+    for key, error in errors.items():
+        if key in stale:
+            _count("stale_served")
+            menus[key] = stale[key]
+        else:
+            failures[key] = error
+    return menus, failures
+
+def _fetch_concurrently(pending, max_workers, timeout, deadline):
+    """
+    Fetches [(key, day, location_id, meal_id), ...] from AVI on a thread pool and
+    caches what came back. Returns ({key: items}, {key: exception}).
+    """
+    # Workers only make the requests; the results are cached here in one
+    # transaction, so the pool threads never open the cache file
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(pending)), thread_name_prefix="menu-fetch")
+    futures = {pool.submit(_fetch, day, location_id, meal_id, timeout): (key, day, location_id, meal_id)
+               for key, day, location_id, meal_id in pending}
+    done, _ = wait(futures, timeout=deadline)
+    pool.shutdown(wait=False, cancel_futures=True) # stragglers finish in the background, uncached
+
+    fetched, errors, to_store = {}, {}, {}
+    for future, (key, day, location_id, meal_id) in futures.items():
+        if future in done and future.exception() is None:
+            fetched[key] = to_store[(day, location_id, meal_id)] = future.result()
+        else:
+            errors[key] = future.exception() if future in done else TimeoutError(f"no answer within {deadline} s")
+    if to_store:
+        store_menus(to_store)
+    return fetched, errors
+
+# ------ Menu DataFrame -------
+# Flattens the AVI items into one typed row per dish with whole-column steps
+# instead of an apply per column and a lambda pass per nutrient. The same frame
+# feeds the empty-menu check and the rendered rows on the home page and the food
+# journal. Nutrients are float32 and the repetitive text columns are
+# categoricals, which keeps a week of every hall small.
+DROPPED_COLUMNS = ["image", "id", "categoryName", "stationOrder", "price", "nutritionals"]
+DROPPED_NUTRIENTS = ["id", "corporateProductId", "caloriesFromSatFat"]
+CATEGORY_COLUMNS = ["stationName", "servingSizeUOM"]
+
+def _tags(column, bits):
+    """A [{"name": ...}, ...] column as categorical "a,b" text plus the dietary mask of each row."""
+    text = pd.Categorical([",".join([tag["name"] for tag in cell]) if type(cell) is list else "" for cell in column])
+    # There are only a few distinct combinations, so encode each once and index by category code
+    category_masks = np.array([dietary.encode(c.split(",") if c else [], bits) for c in text.categories] or [0],
+                              dtype="int64")
+    return text, category_masks[text.codes]
+
+def normalize_menu(items):
+    """
+    One row per dish: name, stationName, allergens/preferences as "a,b" text,
+    their dietary masks (allergen_mask, restriction_mask) and one float32 column
+    per nutrient. Empty if items is.
+    """
+    if not items:
+        return pd.DataFrame()
+    df = pd.DataFrame(items)
+    if "id" in df:
+        df = df.drop_duplicates(subset=["id"], keep="first")
+    df = df.reset_index(drop=True)
+
+    for column, bits, mask_column in [("allergens", dietary.ALLERGEN_BITS, "allergen_mask"),
+                                      ("preferences", dietary.RESTRICTION_BITS, "restriction_mask")]:
+        df[column], df[mask_column] = _tags(df[column] if column in df else [None] * len(df), bits)
+
+    # All the nutritionals dicts become columns in one go, then each column is converted whole
+    nutrients = pd.DataFrame([] if "nutritionals" not in df else
+                             [n if isinstance(n, dict) else {} for n in df["nutritionals"]], index=df.index)
+    nutrients = nutrients.drop(columns=DROPPED_NUTRIENTS, errors="ignore")
+    numeric = [c for c in nutrients.columns if c != "servingSizeUOM"]
+    nutrients[numeric] = nutrients[numeric].apply(pd.to_numeric, errors="coerce").fillna(0).astype("float32")
+
+    df = pd.concat([df.drop(columns=DROPPED_COLUMNS, errors="ignore"), nutrients], axis=1)
+    if "name" in df:
+        df["name"] = df["name"].fillna("")
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].fillna("").astype("category")
+    return df
+
+def allowed_dishes(df, user_allergen_mask, user_restriction_mask):
+    """
+    The rows of a normalize_menu frame the user can eat, same rule as
+    dietary.dish_allowed but for every dish at once.
+    """
+    if df.empty:
+        return df
+    no_allergens = (df["allergen_mask"] & user_allergen_mask) == 0
+    fits_restrictions = (df["restriction_mask"] & user_restriction_mask) != 0 if user_restriction_mask else True
+    return df[no_allergens & fits_restrictions]
+
+def get_menu_cache_stats():
+    with _stats_lock:
+        stats = dict(menu_cache_stats)
+        samples = sorted(_upstream_ms)
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    stats["upstream_p50_ms"] = round(samples[len(samples) // 2], 1) if samples else None
+    stats["upstream_p95_ms"] = round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 1) if samples else None
+    stats["connections"] = _pool.get_stats()["open"]
+    return stats
+
+# ------ Background prefetch -------
+# A daemon thread, one per app process and not tied to any session, keeps every
+# menu for today and tomorrow fresh in the cache, so no page waits on AVI when
+# everyone shows up for a meal. That means all of them, not only the meal being
+# served: home's favorites check reads all of today's menus on every render. A
+# copy is fetched again shortly before it would go stale, and each meal is also
+# fetched once more PREFETCH_LEAD before its window in MEAL_WINDOWS opens, so the
+# copy people see when it opens is current.
+#
+# The thread is started by render_sidebar, so a cold process still makes its first
+# visitor wait on AVI for whatever isn't cached yet; every page after that is
+# served from the cache.
+PREFETCH_INTERVAL = 60                   # seconds between checks
+PREFETCH_LEAD = 30 * 60                  # start warming a meal this long before it's served
+PREFETCH_MARGIN = 2 * PREFETCH_INTERVAL  # refresh anything that goes stale before the check after next
+
+prefetch_stats = {
+    "runs": 0,
+    "menus_fetched": 0,
+    "failures": 0,
+    "last_run": None,
+    "last_run_ms": None,
+}
+_prefetcher = {"thread": None, "lock": threading.Lock()}
+
+def menus_due_for_prefetch(now=None):
+    """The (day, location_id, meal_id) keys the prefetcher should fetch right now."""
+    now = now or datetime.now(TIMEZONE)
+    today, tomorrow = now.date(), now.date() + timedelta(days=1)
+    with _pool.checkout() as conn:
+        cached = {(date, location_id, meal_id): (fetched_at, item_count) for date, location_id, meal_id, fetched_at, item_count
+                  in conn.execute('''
+                      SELECT date, location_id, meal_id, fetched_at, json_array_length(items) FROM menu_cache
+                      WHERE date IN (?, ?)
+                  ''', (today.isoformat(), tomorrow.isoformat()))}
+
+    due = []
+    for info in MENU_IDS:
+        location_id, meal_id = info["locationID"], info["mealID"]
+        opens = now.replace(hour=MEAL_WINDOWS[info["meal"]][0], minute=0, second=0, microsecond=0)
+        warm_from = (opens - timedelta(seconds=PREFETCH_LEAD)).timestamp()
+        for day in (today, tomorrow):
+            copy = cached.get((day.isoformat(), location_id, meal_id))
+            if copy is None:
+                due.append((day, location_id, meal_id))
+                continue
+            fetched_at, item_count = copy
+            expires_at = _expires_at(day, meal_id, item_count, fetched_at)
+            if expires_at is not None and expires_at - now.timestamp() < PREFETCH_MARGIN:
+                due.append((day, location_id, meal_id))
+            elif day == today and fetched_at < warm_from <= now.timestamp() and expires_at is not None:
+                due.append((day, location_id, meal_id)) # about to be served, fetched before the lead
+    return due
+
+def prefetch_once(now=None):
+    """Fetches whatever menus_due_for_prefetch says. Returns how many were fetched."""
+    start = time.perf_counter()
+    due = menus_due_for_prefetch(now)
+    fetched, errors = {}, {}
+    if due:
+        fetched, errors = _fetch_concurrently([(key,) + key for key in due], MENU_FETCH_CONCURRENCY,
+                                              MENU_FETCH_TIMEOUT, MENU_FETCH_DEADLINE)
+        for (day, location_id, meal_id), error in errors.items():
+            logger.warning("Menu prefetch for %s %s/%s failed: %s", day, location_id, meal_id, error)
+    with _stats_lock:
+        prefetch_stats["runs"] += 1
+        prefetch_stats["menus_fetched"] += len(fetched)
+        prefetch_stats["failures"] += len(errors)
+        prefetch_stats["last_run"] = datetime.now(TIMEZONE).isoformat(timespec="seconds")
+        prefetch_stats["last_run_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return len(fetched)
+
+def _prefetch_loop():
+    while True:
+        try:
+            prefetch_once()
+        except Exception as e: # keep the thread alive, try again next time
+            logger.warning("Menu prefetch failed: %s", e)
+        time.sleep(PREFETCH_INTERVAL)
+
+def start_prefetcher():
+    """Starts the background prefetch thread once per process."""
+    with _prefetcher["lock"]:
+        if _prefetcher["thread"] is not None and _prefetcher["thread"].is_alive():
+            return
+        _prefetcher["thread"] = threading.Thread(target=_prefetch_loop, name="menu-prefetch", daemon=True)
+        _prefetcher["thread"].start()
+
+def get_prefetch_stats():
+    with _stats_lock:
+        stats = dict(prefetch_stats)
+    stats["running"] = _prefetcher["thread"] is not None and _prefetcher["thread"].is_alive()
+    return stats
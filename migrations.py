@@ -0,0 +1,355 @@
+import os
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import dietary
+from db_connection import connection
+
+# Schema changes live here as numbered steps instead of in init_db, so an existing
+# DB file (including one downloaded from GitHub that an older version of the app
+# uploaded) gets brought up to date the same way a new one is created.
+# schema_migrations remembers which steps a file already has. Each step runs in
+# its own transaction together with its schema_migrations row, and is written so
+# running it on a file that somehow already has the change is harmless.
+# Only ever add new steps at the end; don't edit one that has shipped.
+
+def _create_base_tables(cursor):
+    # Table for individual users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT,
+            diningHall TEXT,
+            allergens TEXT,
+            dietaryRestrictions TEXT,
+            favorites TEXT
+        )
+    ''')
+
+    # Table for submission summaries
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS food_journal (
+            entry_id TEXT PRIMARY KEY,
+            user_id INTEGER AUTO_INCREMENT,
+            date TEXT,
+            meal_type TEXT,
+            food_item TEXT,
+            dining_hall TEXT,
+            notes TEXT,
+            calories FLOAT,
+            protein FLOAT,
+            carbs FLOAT,
+            fat FLOAT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+def _create_sync_tables(cursor):
+    # Row-level change log used for delta syncing (see db_sync.push_changes_to_github).
+    # Rows with changeset_id NULL haven't been shipped to GitHub yet.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            changeset_id TEXT,
+            table_name TEXT,
+            op TEXT,
+            row_key TEXT,
+            payload TEXT,
+            created_at TEXT
+        )
+    ''')
+
+    # Changesets (ours and other replicas') that are already applied to this DB file
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_applied (
+            changeset_id TEXT PRIMARY KEY,
+            applied_at TEXT
+        )
+    ''')
+
+def _unique_user_emails(cursor):
+    # Every lookup is WHERE email = ?, which was a full scan of users. Older files
+    # can have the same email twice (a food journal visit before the walkthrough
+    # created a bare row, then the walkthrough inserted another), so fold those
+    # into the oldest row first: keep its user_id, take the newest non-empty value
+    # of each column and point its journal entries at it.
+    dupes = cursor.execute('''
+        SELECT email, MIN(user_id) FROM users
+        WHERE email IS NOT NULL GROUP BY email HAVING COUNT(*) > 1
+    ''').fetchall()
+    for email, keep_id in dupes:
+        for col in ["diningHall", "allergens", "dietaryRestrictions", "favorites"]:
+            cursor.execute(f'''
+                UPDATE users SET {col} = COALESCE((
+                    SELECT {col} FROM users WHERE email = ? AND {col} IS NOT NULL AND {col} != ''
+                    ORDER BY user_id DESC LIMIT 1), {col})
+                WHERE user_id = ?
+            ''', (email, keep_id))
+        cursor.execute('''
+            UPDATE food_journal SET user_id = ?
+            WHERE user_id IN (SELECT user_id FROM users WHERE email = ? AND user_id != ?)
+        ''', (keep_id, email, keep_id))
+        cursor.execute("DELETE FROM users WHERE email = ? AND user_id != ?", (email, keep_id))
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+
+def _index_journal_by_user_date(cursor):
+    # get_food_entries filters on user_id and date and sorts by date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_food_journal_user_date ON food_journal (user_id, date)")
+
+def parse_legacy_favorites(blob):
+    """
+    Dish names out of an old users.favorites value: settings wrote a JSON list,
+    notification.py wrote comma-joined text.
+    """
+    if not blob:
+        return []
+    try:
+        dishes = json.loads(blob)
+    except ValueError:
+        dishes = blob.split(",")
+    if not isinstance(dishes, list):
+        dishes = [dishes]
+    return [str(dish).strip() for dish in dishes if str(dish).strip()]
+
+def _normalize_favorites(cursor):
+    # Favorites were a blob in users.favorites, rewritten in full on every add or
+    # remove. They move to one row per (user, dish). The shipped DB already has an
+    # empty user_favorites table, but with user_id TEXT, which doesn't match
+    # users.user_id, so that gets rebuilt (keeping any rows) rather than reused.
+    cursor.execute('''
+        CREATE TABLE user_favorites_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            dish_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, dish_name)
+        )
+    ''')
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_favorites'").fetchone():
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_favorites_new (user_id, dish_name, created_at)
+            SELECT CAST(user_id AS INTEGER), dish_name, created_at FROM user_favorites
+            WHERE user_id IS NOT NULL AND dish_name IS NOT NULL ORDER BY id
+        ''')
+        cursor.execute("DROP TABLE user_favorites")
+    cursor.execute("ALTER TABLE user_favorites_new RENAME TO user_favorites")
+    # UNIQUE(user_id, dish_name) covers a user's list; this covers dish -> users
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_favorites_dish ON user_favorites (dish_name)")
+
+    rows = cursor.execute("SELECT user_id, favorites FROM users WHERE favorites IS NOT NULL AND favorites != ''").fetchall()
+    cursor.executemany("INSERT OR IGNORE INTO user_favorites (user_id, dish_name) VALUES (?, ?)",
+                       [(user_id, dish) for user_id, blob in rows for dish in parse_legacy_favorites(blob)])
+    # The column stays (SQLite can't drop it everywhere) but nothing reads it any more
+    cursor.execute("UPDATE users SET favorites = NULL")
+
+def _dietary_bitmasks(cursor):
+    # allergens and dietaryRestrictions held str(list) or JSON text, parsed with
+    # ast.literal_eval on every page load. They become integer masks over the
+    # dietary.ALLERGENS / dietary.RESTRICTIONS lists.
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(users)")]
+    if "allergen_mask" not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN allergen_mask INTEGER NOT NULL DEFAULT 0")
+    if "restriction_mask" not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN restriction_mask INTEGER NOT NULL DEFAULT 0")
+
+    rows = cursor.execute('''
+        SELECT user_id, allergens, dietaryRestrictions FROM users
+        WHERE allergens IS NOT NULL OR dietaryRestrictions IS NOT NULL
+    ''').fetchall()
+    cursor.executemany("UPDATE users SET allergen_mask = ?, restriction_mask = ? WHERE user_id = ?", [
+        (dietary.encode_allergens(dietary.parse_legacy_list(allergens)),
+         dietary.encode_restrictions(dietary.parse_legacy_list(restrictions)), user_id)
+        for user_id, allergens, restrictions in rows
+    ])
+    # Like users.favorites, the old columns stay but nothing reads them any more
+    cursor.execute("UPDATE users SET allergens = NULL, dietaryRestrictions = NULL")
+
+def rebuild_daily_totals(cursor):
+    """Recomputes daily_totals from food_journal from scratch."""
+    cursor.execute("DELETE FROM daily_totals")
+    cursor.execute('''
+        INSERT INTO daily_totals (user_id, date, meal_type, calories, protein, carbs, fat, entries)
+        SELECT user_id, IFNULL(date, ''), IFNULL(meal_type, ''), TOTAL(calories), TOTAL(protein),
+               TOTAL(carbs), TOTAL(fat), COUNT(*)
+        FROM food_journal WHERE user_id IS NOT NULL
+        GROUP BY user_id, IFNULL(date, ''), IFNULL(meal_type, '')
+    ''')
+
+def _daily_totals(cursor):
+    # Per (user, day, meal type) sums of food_journal, so metrics read one row per
+    # day instead of every entry. Triggers keep it current on every write path,
+    # including changesets applied by db_sync. NULL date/meal_type are stored as ''
+    # so they still land on one key; entries without a user aren't counted.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            meal_type TEXT NOT NULL,
+            calories REAL NOT NULL DEFAULT 0,
+            protein REAL NOT NULL DEFAULT 0,
+            carbs REAL NOT NULL DEFAULT 0,
+            fat REAL NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date, meal_type)
+        ) WITHOUT ROWID
+    ''')
+
+    add_new = '''
+        INSERT INTO daily_totals (user_id, date, meal_type, calories, protein, carbs, fat, entries)
+        SELECT NEW.user_id, IFNULL(NEW.date, ''), IFNULL(NEW.meal_type, ''), IFNULL(NEW.calories, 0),
+               IFNULL(NEW.protein, 0), IFNULL(NEW.carbs, 0), IFNULL(NEW.fat, 0), 1
+        WHERE NEW.user_id IS NOT NULL
+        ON CONFLICT (user_id, date, meal_type) DO UPDATE SET
+            calories = calories + excluded.calories, protein = protein + excluded.protein,
+            carbs = carbs + excluded.carbs, fat = fat + excluded.fat, entries = entries + 1;
+    '''
+    remove_old = '''
+        UPDATE daily_totals SET
+            calories = calories - IFNULL(OLD.calories, 0), protein = protein - IFNULL(OLD.protein, 0),
+            carbs = carbs - IFNULL(OLD.carbs, 0), fat = fat - IFNULL(OLD.fat, 0), entries = entries - 1
+        WHERE user_id = OLD.user_id AND date = IFNULL(OLD.date, '') AND meal_type = IFNULL(OLD.meal_type, '');
+        DELETE FROM daily_totals
+        WHERE user_id = OLD.user_id AND date = IFNULL(OLD.date, '') AND meal_type = IFNULL(OLD.meal_type, '')
+            AND entries <= 0;
+    '''
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS daily_totals_insert AFTER INSERT ON food_journal BEGIN {add_new} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS daily_totals_delete AFTER DELETE ON food_journal BEGIN {remove_old} END")
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS daily_totals_update
+        AFTER UPDATE OF user_id, date, meal_type, calories, protein, carbs, fat ON food_journal
+        BEGIN {remove_old} {add_new} END
+    ''')
+    rebuild_daily_totals(cursor)
+
+def _index_journal_history(cursor):
+    # In get_food_entries_page's order (see there); it also serves every (user_id, date) lookup
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_food_journal_user_history
+        ON food_journal (user_id, date DESC, meal_type, entry_id)
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_food_journal_user_date")
+
+# (version, name, step), in the order they run
+MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "sync tables", _create_sync_tables),
+    (3, "unique users.email", _unique_user_emails),
+    (4, "food_journal (user_id, date) index", _index_journal_by_user_date),
+    (5, "normalized user_favorites", _normalize_favorites),
+    (6, "allergen/restriction bitmasks", _dietary_bitmasks),
+    (7, "daily_totals summary table", _daily_totals),
+    (8, "food_journal history index", _index_journal_history),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_migrated_files = set() # (path, inode) of files already at LATEST_VERSION in this process
+
+def _file_key(db_path):
+    # The inode changes when db_sync swaps a download in, so a new file is checked again
+    return os.path.realpath(db_path), os.stat(db_path).st_ino
+
+def get_schema_version(conn):
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0 # from before migrations existed
+
+def migrate(db_path):
+    """
+    Runs whatever migrations db_path doesn't have yet and returns the list of
+    versions that ran. Streamlit calls this on every rerun, so once a file is up
+    to date it's skipped without touching the DB.
+    """
+    if os.path.exists(db_path) and _file_key(db_path) in _migrated_files:
+        return []
+
+    ran = []
+    with connection(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )
+        ''')
+        if get_schema_version(conn) < LATEST_VERSION:
+            for version, name, step in MIGRATIONS:
+                # IMMEDIATE takes the write lock up front, so if another process is
+                # migrating the same file we wait for it and then see its rows
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    applied = conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?",
+                                           (version,)).fetchone()
+                    if not applied:
+                        step(conn.cursor())
+                        conn.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                                     (version, name, datetime.now(timezone.utc).isoformat()))
+                        ran.append(version)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+
+    _migrated_files.add(_file_key(db_path))
+    return ran
+
+# ------ Query plan checks -------
+# The queries the app runs most, and the index each one should be using. If a
+# schema change makes one of these fall back to a full scan, assert_query_plans says so.
+HOT_QUERIES = [
+    ("user by email (checkNewUser, get_or_create_user, settings)",
+     "SELECT user_id FROM users WHERE email = ?", ("someone@wellesley.edu",),
+     "idx_users_email"),
+    ("journal for one day (get_food_entries with a date)",
+     "SELECT * FROM food_journal WHERE user_id = ? AND date = ? ORDER BY meal_type", (1, "2025-01-01"),
+     "idx_food_journal_user_history"),
+    ("whole journal (get_food_entries)",
+     "SELECT * FROM food_journal WHERE user_id = ? ORDER BY date DESC, meal_type", (1,),
+     "idx_food_journal_user_history"),
+    ("next history page (get_food_entries_page)",
+     "SELECT * FROM food_journal WHERE user_id = ? AND date <= ? "
+     "AND (date < ? OR (date = ? AND ((meal_type, entry_id) > (?, ?)))) ORDER BY date DESC, meal_type, entry_id LIMIT ?",
+     (1, "2025-01-01", "2025-01-01", "2025-01-01", "Lunch", "x", 51),
+     "idx_food_journal_user_history"),
+    ("history page among undated entries (get_food_entries_page)",
+     "SELECT * FROM food_journal WHERE user_id = ? AND date IS NULL "
+     "AND ((meal_type, entry_id) > (?, ?)) ORDER BY date DESC, meal_type, entry_id LIMIT ?",
+     (1, "Lunch", 1, 51), "idx_food_journal_user_history"),
+    ("macro rollup for a date range (get_macro_rollup)",
+     "SELECT date, SUM(calories), SUM(protein), SUM(carbs), SUM(fat), SUM(entries) FROM daily_totals "
+     "WHERE user_id = ? AND date >= ? AND date <= ? GROUP BY date", (1, "2025-01-01", "2025-01-31"),
+     "PRIMARY KEY"),
+    ("a user's favorites (get_user_favorites)",
+     "SELECT f.dish_name FROM user_favorites f JOIN users u ON u.user_id = f.user_id WHERE u.email = ? ORDER BY f.id",
+     ("someone@wellesley.edu",), "sqlite_autoindex_user_favorites_1"),
+    ("who favorited a dish (get_users_who_favorited)",
+     "SELECT u.email FROM user_favorites f JOIN users u ON u.user_id = f.user_id WHERE f.dish_name = ?",
+     ("Pad Thai",), "idx_user_favorites_dish"),
+]
+
+def explain(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN output as a list of plan lines."""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def assert_query_plans(conn):
+    """Raises AssertionError if a hot query isn't using its index. Returns the plans."""
+    plans = {}
+    for name, sql, params, index in HOT_QUERIES:
+        plan = explain(conn, sql, params)
+        plans[name] = plan
+        assert any(index in line for line in plan), f"{name} doesn't use {index}: {plan}"
+    return plans
+
+if __name__ == "__main__":
+    # python migrations.py [db file] - migrate a file and check the query plans
+    import sys
+    from db_sync import get_db_path
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else get_db_path()
+    print(f"{db_path}: ran migrations {migrate(db_path) or 'none'}")
+    with connection(db_path) as conn:
+        print(f"Schema version {get_schema_version(conn)}")
+        for name, plan in assert_query_plans(conn).items():
+            print(f"{name}:\n    " + "\n    ".join(plan))
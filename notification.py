@@ -1,67 +1,29 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import requests
+import http_client
+import menus
 from datetime import datetime
 from collections import defaultdict
-from contextlib import contextmanager
+import logging
 
-from db_sync import get_db_path
-DB_PATH = get_db_path()
+import update_database
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+logger = logging.getLogger(__name__)
 
 
+# Favorites live in update_database's user_favorites table; these keep the
+# True/False answers the notification code expects.
 def add_favorite_dish(email, dish_name):
-    """Add a favorite dish to the user's favorites column."""
-    favorites = get_user_favorite_dishes(email)
-    if dish_name in favorites:
-        return False  # Already exists
-
-    favorites.append(dish_name)
-    new_fav_str = ",".join(favorites)
-
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET favorites = ? WHERE email = ?", (new_fav_str, email))
-    conn.commit()
-    conn.close()
-    return True
+    """Add a favorite dish for the user. False if it was already there."""
+    return bool(update_database.add_favorite_dishes(email, [dish_name]))
 
 def delete_favorite_dish(email, dish_name):
-    favorites = get_user_favorite_dishes(email)
-    if dish_name not in favorites:
-        return False
-
-    favorites.remove(dish_name)
-    new_fav_str = ",".join(favorites)
-
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET favorites = ? WHERE email = ?", (new_fav_str, email))
-    conn.commit()
-    conn.close()
-    return True
+    return bool(update_database.remove_favorite_dishes(email, [dish_name]))
 
 def get_user_favorite_dishes(email):
-    """Fetch favorite dishes from the users table (new format)."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT favorites FROM users WHERE email = ?", (email,))
-    row = c.fetchone()
-    conn.close()
-
-    if row and row[0]:
-        return row[0].split(",")  # Assumes comma-separated string
-    return []
+    """Fetch the user's favorite dishes."""
+    return update_database.get_user_favorites(email)
 
 def get_menu_items(date, location_ids, meal_ids):
     """Get menu items for specified date, locations, and meals"""
@@ -78,7 +40,7 @@ def get_menu_items(date, location_ids, meal_ids):
             }
             
             try:
-                response = requests.get(base_url, params=params)
+                response = http_client.get(base_url, params=params)
                 response.raise_for_status()
                 menu_items = response.json()
                 
@@ -142,41 +104,34 @@ def check_favorites_available(user_email):
     
     return result
 
-@st.cache_data(ttl=3600)
-def get_all_menus_for_week(days=7):
-    """Fetch all menu items from the past `days` days across all dining halls."""
-    idInfo = [
-        {"location": "Bae", "meal": "Breakfast", "locationID": 96, "mealID": 148},
-        {"location": "Bae", "meal": "Lunch", "locationID": 96, "mealID": 149},
-        {"location": "Bae", "meal": "Dinner", "locationID": 96, "mealID": 312},
-        {"location": "Bates", "meal": "Breakfast", "locationID": 95, "mealID": 145},
-        {"location": "Bates", "meal": "Lunch", "locationID": 95, "mealID": 146},
-        {"location": "Bates", "meal": "Dinner", "locationID": 95, "mealID": 311},
-        {"location": "Stone D", "meal": "Breakfast", "locationID": 131, "mealID": 261},
-        {"location": "Stone D", "meal": "Lunch", "locationID": 131, "mealID": 262},
-        {"location": "Stone D", "meal": "Dinner", "locationID": 131, "mealID": 263},
-        {"location": "Tower", "meal": "Breakfast", "locationID": 97, "mealID": 153},
-        {"location": "Tower", "meal": "Lunch", "locationID": 97, "mealID": 154},
-        {"location": "Tower", "meal": "Dinner", "locationID": 97, "mealID": 310}
-    ]
+def fetch_all_menus(days=7):
+    """
+    Menu items from the past `days` days across all dining halls, plus a list of
+    the hall/meal/date menus that couldn't be loaded.
+    """
+    # All 12 x days menus go through menus.fetch_menus, which reads the cached ones
+    # and fetches the rest from AVI in parallel
+    keys = {}
+    for delta in range(days):
+        date_str = (datetime.now() - pd.Timedelta(days=delta)).strftime("%m-%d-%Y")
+        for info in menus.MENU_IDS:
+            keys[(date_str, info["locationID"], info["mealID"])] = info
+    menus_by_key, failures = menus.fetch_menus(keys)
 
     all_items = []
+    for key, info in keys.items():
+        for item in menus_by_key.get(key, []):
+            item['location'] = info["location"]
+            item['meal'] = info["meal"]
+            item['date'] = key[0]
+            all_items.append(item)
 
-    for delta in range(days):
-        date_str = (datetime.now() - pd.Timedelta(days=delta)).strftime("%m-%d-%Y")
-        for info in idInfo:
-            try:
-                r = requests.get(
-                    "https://dish.avifoodsystems.com/api/menu-items",
-                    params={"date": date_str, "locationID": info["locationID"], "mealID": info["mealID"]}
-                )
-                menu_items = r.json()
-                for item in menu_items:
-                    item['location'] = info["location"]
-                    item['meal'] = info["meal"]
-                    item['date'] = date_str
-                    all_items.append(item)
-            except:
-                continue
+    failed = [f"{keys[key]['location']} {keys[key]['meal']} {key[0]} ({error})" for key, error in failures.items()]
+    return all_items, failed
 
-    return all_items
\ No newline at end of file
+def get_all_menus_for_week(days=7):
+    """Fetch all menu items from the past `days` days across all dining halls."""
+    all_items, failed = fetch_all_menus(days)
+    if failed:
+        logger.warning("Couldn't load %d menus: %s", len(failed), "; ".join(failed))
+    return all_items
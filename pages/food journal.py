@@ -2,11 +2,11 @@ import streamlit as st
 from datetime import datetime
 from home import render_sidebar, get_params, dfKeys
 from user_profile import get_user_info
-from update_database import add_food_entry, get_food_entries, delete_food_entry, fetch_user_info
-from db_sync import download_db_from_github, push_db_to_github
-import requests
+from update_database import add_food_entries, get_food_entries, get_food_entries_page, delete_food_entry, fetch_user_info, get_user_dietary_masks
+from db_sync import download_db_from_github, request_sync
+import menus
 from collections import defaultdict
-import ast
+from itertools import groupby
 
 st.set_page_config(page_title="Log Meals", layout="wide")
 render_sidebar()
@@ -18,39 +18,14 @@ if "access_token" not in st.session_state:
 
 
 user = get_user_info(st.session_state["access_token"])
-user_record = fetch_user_info(user["email"])
 user_id = fetch_user_info(user["email"])[0]
-user_allergens = []
-# user_preferences = [] not enough time to look into dietary restrictions/preferences
-
-# Code below from ChatGPT 
-
-# Learning about the ast (Abstract Syntax Trees) library
-
-# ast.literal_eval() is a safe version of eal() that only evaluations
-# Python literals such as strings, numbers, lists, dicts, etc.
-
-# Example: safe parsing of a string that looks like a list
-# ast.literal_eval('[1, 2, 3]')
-# # ➝ [1, 2, 3]
-
-if user_record:
-    try:
-        user_allergens = ast.literal_eval(user_record[3]) if user_record[3] else []
-        user_preferences = ast.literal_eval(user_record[4]) if user_record[4] else []
-    except Exception as e:
-        st.warning("Could not parse stored user allergies/preferences.")
+# Bitmasks over dietary.ALLERGENS / dietary.RESTRICTIONS, so filtering a dish is a bitwise AND
+user_allergen_mask, user_restriction_mask = get_user_dietary_masks(user["email"])
 
 if 'selected_dishes' not in st.session_state:
     st.session_state['selected_dishes'] = []
 
-tab1, tab2, tab3 = st.tabs(["Select", "Log", "Journal"])
-
-def dropKeys(cell): # from home, drop irrelevant keys
-    cell.pop("id", None)
-    cell.pop("corporateProductId", None)
-    cell.pop("caloriesFromSatFat", None)
-    return cell
+tab1, tab2, tab3, tab4 = st.tabs(["Select", "Log", "Journal", "History"])
 
 with tab1:
     col1, col2, col3 = st.columns(3)
@@ -74,38 +49,31 @@ with tab1:
         "locationID": location_id,
         "mealID": meal_id
     }
-    r = requests.get("https://dish.avifoodsystems.com/api/menu-items", params=params)
-    items = r.json()
+    # Same cleaned frame as the home page (menus.normalize_menu)
+    menu = menus.normalize_menu(menus.get_menu_items(params["date"], location_id, meal_id))
+    shown = menus.allowed_dishes(menu, user_allergen_mask, user_restriction_mask) if apply_custom_filter else menu
 
-    if items:
+    if not menu.empty:
         st.subheader(f"{selected_meal} at {selected_location}")
         header = st.columns([3, 1.5, 2.5, 0.5])
         header[0].markdown("**Dish**")
         header[1].markdown("**Calories**")
         header[2].markdown("**Station**")
         header[3].markdown("**Log**")
-        for i, item in enumerate(items):
+        # i is the dish's row in the full menu, so checkbox keys don't change when the filter is toggled
+        for i, item in zip(shown.index, shown.to_dict("records")):
             name = item.get("name", "")
             station = item.get("stationName", "")
-            allergies = [a['name'] for a in item.get("allergens", [])]
-            preferences = [p['name'] for p in item.get("preferences", [])]
-
-            if apply_custom_filter:
-                if any(allergen in user_allergens for allergen in allergies):
-                    continue
-                if user_preferences and not any(pref in preferences for pref in user_preferences):
-                    continue
-
-            nutrition = item.get("nutritionals", {})
-            nutrition = dropKeys(nutrition) if nutrition else {}
-            calories = nutrition.get("calories", 0.0)
-            protein = nutrition.get("protein", 0.0)
-            carbs = nutrition.get("carbohydrates", 0.0)
-            fat = nutrition.get("fat", 0.0)
+
+            # float32 columns; rounded so 12.3 doesn't come out as 12.300000190734863
+            calories = round(float(item.get("calories", 0.0)), 2)
+            protein = round(float(item.get("protein", 0.0)), 2)
+            carbs = round(float(item.get("carbohydrates", 0.0)), 2)
+            fat = round(float(item.get("fat", 0.0)), 2)
 
             row = st.columns([3, 1.5, 2.5, 0.5])  # tighter layout
             row[0].write(name)
-            row[1].write(f"{calories} cal")
+            row[1].write(f"{calories:g} cal")
             row[2].write(station)
             checked = row[3].checkbox("", key=f"add_{selected_meal}_{name}_{i}")
             if checked and name not in [x['name'] for x in st.session_state['selected_dishes']]:
@@ -157,20 +125,18 @@ with tab2:
         notes = st.text_area("Meal Notes")
 
         if st.button("Log Meal Entry"):
-            for d in st.session_state['selected_dishes']:
-                add_food_entry(
-                    user_id,
-                    log_date.strftime("%Y-%m-%d"),
-                    meal_type,
-                    d['name'],
-                    d['dining_hall'],
-                    notes,
-                    d['calories'],
-                    d['protein'],
-                    d['carbs'],
-                    d['fat']
-                )
-            push_db_to_github()
+            add_food_entries(user_id, [{
+                "date": log_date.strftime("%Y-%m-%d"),
+                "meal_type": meal_type,
+                "food_item": d['name'],
+                "dining_hall": d['dining_hall'],
+                "notes": notes,
+                "calories": d['calories'],
+                "protein": d['protein'],
+                "carbs": d['carbs'],
+                "fat": d['fat'],
+            } for d in st.session_state['selected_dishes']])
+            request_sync()
             st.session_state['last_logged_date'] = log_date
             st.success("Meal successfully logged and synced!")
 
@@ -233,7 +199,34 @@ with tab3:
                             with col3:
                                 if st.button("✕", key=f"delete_{entry['entry_id']}"):
                                     delete_food_entry(entry["entry_id"])
-                                    push_db_to_github()
+                                    request_sync()
                                     st.rerun()
     else:
         st.info("No food logs for this day yet.")
+
+with tab4:
+    st.header("Your Food Log History")
+    HISTORY_PAGE_SIZE = 50
+
+    # Cursors of the pages loaded so far; each rerun re-reads just those pages
+    if "history_cursors" not in st.session_state:
+        st.session_state["history_cursors"] = [None]
+
+    next_cursor = None
+    history = []
+    for after in st.session_state["history_cursors"]:
+        page, next_cursor = get_food_entries_page(user_id, HISTORY_PAGE_SIZE, after)
+        history.extend(page)
+
+    if history:
+        for date, day_entries in groupby(history, key=lambda e: e["date"]):
+            day_entries = list(day_entries)
+            st.subheader(date or "No date")
+            for entry in day_entries:
+                st.caption(f"{entry['meal_type']} · **{entry['food_item']}** · {entry['dining_hall']} · "
+                           f"{entry['calories'] or 0:.0f} cal")
+        if next_cursor is not None and st.button("Load more", key="history_more"):
+            st.session_state["history_cursors"].append(next_cursor)
+            st.rerun()
+    else:
+        st.info("No food logs yet.")
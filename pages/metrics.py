@@ -6,9 +6,8 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from home import render_sidebar
-from update_database import fetch_food_journal
-from db_sync import get_db_path
-import sqlite3
+from update_database import fetch_user_info, get_macro_rollup, get_journal_date_range, get_dining_hall_visits
+from user_profile import get_user_info
 
 render_sidebar()
 
@@ -17,33 +16,26 @@ if "access_token" not in st.session_state:
     st.warning("Please Log In for Access! 🔒")
     st.stop()
 
-# Fetches food journal entries from SQLite db
-food_journal_data = fetch_food_journal()
+user = get_user_info(st.session_state["access_token"])
+user_record = fetch_user_info(user["email"]) if user else None
+last_date = get_journal_date_range(user_record[0])[1] if user_record else None
 
-# Define columns to be used in df
-columns = [
-    "entry_id", "user_id", "date", "meal_type", "food_item",
-    "dining_hall", "notes", "calories", "protein", "carbs", "fat"
-]
-
-df = pd.DataFrame(food_journal_data, columns=columns) # Create df from journal data
-df['date'] = pd.to_datetime(df['date'], errors='coerce') # Convert 'date' column to datetime format
-
-# Drop rows where 'date' is NaT, ex. when food journal is empty)
-df = df.dropna(subset=['date'])
-
-if df.empty:
+if last_date is None:
     st.warning("No data available. Log your meals to see your metrics!")
+    st.stop()
 
-# Converts the date column into weekly, monthly, yearly periods.
-df['week'] = df['date'].dt.to_period('W').apply(lambda r: r.start_time) #start_time gives the first day of the week
-df['month'] = df['date'].dt.to_period('M').apply(lambda r: r.start_time)
-df['year'] = df['date'].dt.year # gives the year from the date
+user_id = user_record[0]
+last_date = pd.to_datetime(last_date)
 
-# Estimates how many calories came from each macronutrient. ex. each gram of protein is 4 calories
-df['calories_from_protein'] = df['protein'] * 4
-df['calories_from_carbs'] = df['carbs'] * 4
-df['calories_from_fat'] = df['fat'] * 9
+def macro_rollup(period, start, end, by_meal_type=False):
+    # Sums come back from SQLite already grouped (update_database.get_macro_rollup),
+    # one row per day/month, only for this user
+    rollup = pd.DataFrame(get_macro_rollup(user_id, period, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"),
+                                           by_meal_type),
+                          columns=["period_start"] + (["meal_type"] if by_meal_type else []) +
+                                  ["calories", "protein", "carbs", "fat", "entries"])
+    rollup["period_start"] = pd.to_datetime(rollup["period_start"])
+    return rollup
 
 
 def toggleable_macro_plot(df_plot, x_col, title, key):
@@ -102,30 +94,27 @@ tab1, tab2, tab3, tab4 = st.tabs(["Day", "Week", "Month", "Year"])
 # DAILY
 with tab1:
     # Displays a date picker allowing user to select a specific day
-    selected_day = st.date_input("Choose a day", df['date'].max(), key="daily_date")
+    selected_day = st.date_input("Choose a day", last_date, key="daily_date")
     st.subheader("Caloric Intake")
-    # Filters the  df to only include rows from the selected date
-    day_df = df[df['date'] == pd.to_datetime(selected_day)]
-    # If the filtered df is not empty, it means there is data for that day
-    if not day_df.empty:
-        # source: https://pandas.pydata.org/pandas-docs/stable/user_guide/groupby.html#groupby-aggregate
-        # This groups the logs by meal type (breakfast, lunch, dinner) and sums the macros
-        daily_macros = day_df.groupby('meal_type')[['protein', 'carbs', 'fat']].sum().reset_index()
+    # Macros for the selected date, summed per meal type (breakfast, lunch, dinner)
+    daily_macros = macro_rollup("day", selected_day, selected_day, by_meal_type=True)
+    # If the rollup is not empty, it means there is data for that day
+    if not daily_macros.empty:
         toggleable_macro_plot(daily_macros, 'meal_type', f"Caloric Intake – {selected_day.strftime('%Y-%m-%d')}", key="daily")
     else:
         st.info("No data for selected day.")
 
 # WEEKLY
 with tab2:
-    selected_date = st.date_input("Choose a date in the week", df['date'].max(), key="weekly_date")
+    selected_date = st.date_input("Choose a date in the week", last_date, key="weekly_date")
     selected_week = pd.to_datetime(selected_date).to_period("W").start_time
+    week_end = selected_week + pd.Timedelta(days=6)
     st.subheader("Caloric Intake")
-    week_df = df[df['week'] == selected_week]
-    if not week_df.empty:
-        # Adds a column like "Monday", "Tuesday", etc. Used to group entries by day.
-        week_df['day_name'] = week_df['date'].dt.day_name()
-        # Groups the logs by day of the week and sums the macros
-        weekly_macros = week_df.groupby('day_name')[['protein', 'carbs', 'fat']].sum().reset_index()
+    # One row per day of the week that has entries
+    weekly_macros = macro_rollup("day", selected_week, week_end)
+    if not weekly_macros.empty:
+        # Adds a column like "Monday", "Tuesday", etc.
+        weekly_macros['day_name'] = weekly_macros['period_start'].dt.day_name()
         ordered_days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
         weekly_macros['day_name'] = pd.Categorical(weekly_macros['day_name'], categories=ordered_days, ordered=True)
         weekly_macros = weekly_macros.sort_values('day_name')
@@ -133,23 +122,14 @@ with tab2:
 
         # Transition graph generated by ChatGPT given prompts tailored to our needs
         # Count how many times each dining hall was visited that week
-        hall_counts = week_df['dining_hall'].str.strip().str.lower().str.title().value_counts().reset_index()
+        path = [h.strip().lower().title() for h in get_dining_hall_visits(
+            user_id, selected_week.strftime("%Y-%m-%d"), week_end.strftime("%Y-%m-%d"))]
+        hall_counts = pd.Series(path).value_counts().reset_index()
         hall_counts.columns = ['hall', 'visits']
-        transitions = []
 
-        # Groups data by user and sort each user's logs chronologically
-        # Extracts sequences of dining hall visits
-        if 'created_at' in week_df.columns:
-            user_paths = week_df.sort_values(by=['user_id', 'created_at']).groupby('user_id')['dining_hall'].apply(
-                lambda x: [h.strip().lower().title() for h in x]
-            )
-        else:
-            user_paths = week_df.sort_values(by=['user_id']).groupby('user_id')['dining_hall'].apply(
-                lambda x: [h.strip().lower().title() for h in x]
-            )
-        # Build a list of (from_hall, to_hall) pairs representing transitions
-        for path in user_paths:
-            transitions.extend(zip(path[:-1], path[1:]))
+        # The user's dining hall visits in the order they were logged, as
+        # (from_hall, to_hall) pairs representing transitions
+        transitions = list(zip(path[:-1], path[1:]))
         # Converts the transition pairs to a df and count their frequency
         trans_df = pd.DataFrame(transitions, columns=['from', 'to'])
         trans_df = trans_df[trans_df['from'] != trans_df['to']]
@@ -208,18 +188,19 @@ with tab2:
 
 # MONTHLY
 with tab3:
-    selected_date = st.date_input("Choose a date in the month", df['date'].max(), key="monthly_date")
+    selected_date = st.date_input("Choose a date in the month", last_date, key="monthly_date")
     selected_month = pd.to_datetime(selected_date).to_period("M").start_time
+    month_end = selected_month + pd.offsets.MonthEnd(0)
     st.subheader("Caloric Intake")
-    monthly_df = df[df['month'] == selected_month]
-    if not monthly_df.empty:
-        monthly_macros = monthly_df.groupby('date')[['protein', 'carbs', 'fat']].sum().reset_index()
+    # One row per day of the month that has entries, with how many entries it has
+    monthly_macros = macro_rollup("day", selected_month, month_end).rename(columns={"period_start": "date"})
+    if not monthly_macros.empty:
         toggleable_macro_plot(monthly_macros, 'date', f"Caloric Intake – {selected_month.strftime('%B %Y')}", key="monthly")
 
         # Generates a list of all days in the selected month
         # Counts how many entries exist for each day
-        all_days = pd.date_range(start=selected_month, end=selected_month + pd.offsets.MonthEnd(0))
-        log_counts = monthly_df['date'].value_counts().to_dict()
+        all_days = pd.date_range(start=selected_month, end=month_end)
+        log_counts = dict(zip(monthly_macros['date'], monthly_macros['entries']))
 
         # Creates a new DataFrame representing log activity per day
         # Each row = one date in the month, and the number of food entries logged
@@ -249,16 +230,16 @@ with tab3:
 
 # YEARLY
 with tab4:
-    selected_date = st.date_input("Choose a date in the year", df['date'].max(), key="yearly_date")
+    selected_date = st.date_input("Choose a date in the year", last_date, key="yearly_date")
     selected_year = pd.to_datetime(selected_date).year
     st.subheader("Caloric Intake")
-    yearly_df = df[df['year'] == selected_year]
-    if not yearly_df.empty:
+    # One row per month of the year that has entries
+    yearly_macros = macro_rollup("month", pd.Timestamp(selected_year, 1, 1), pd.Timestamp(selected_year, 12, 31))
+    if not yearly_macros.empty:
         # strftime stands for “string format time”.
         # It’s a method used to convert a python/pantas datetime object into a formatted string
         # ex. .strftime('%B') converts each date into its full month name (like "April", "May")
-        yearly_df['month_name'] = yearly_df['date'].dt.strftime('%B')
-        yearly_macros = yearly_df.groupby('month_name')[['protein', 'carbs', 'fat']].sum().reset_index()
+        yearly_macros['month_name'] = yearly_macros['period_start'].dt.strftime('%B')
         month_order = ["January", "February", "March", "April", "May", "June",
                        "July", "August", "September", "October", "November", "December"]
         yearly_macros['month_name'] = pd.Categorical(yearly_macros['month_name'], categories=month_order, ordered=True)
@@ -1,8 +1,9 @@
 import streamlit as st
 from home import render_sidebar
-from notification import get_all_menus_for_week
+from notification import fetch_all_menus
 from user_profile import get_user_info
-from db_sync import push_db_to_github
+from db_sync import request_sync
+from dietary import ALLERGENS, RESTRICTIONS
 from update_database import (
     getUserFavDiningHall,
     update_user_dining_hall,
@@ -42,7 +43,7 @@ favHall = st.selectbox("Select", ["Tower", "Bates", "Lulu", "Stone D"]) # Instea
 
 if st.button("Update"):
     update_user_dining_hall(user.get("email"), favHall)
-    push_db_to_github()
+    request_sync()
     st.success("Dining hall preference updated and synced!")
 
 # ----------------- Favorite Dishes Section ----------------- #
@@ -50,7 +51,9 @@ st.header("Favorite Dishes")
 st.markdown("Add your favorite dishes to get notified when they're available.")
 
 favorites = get_user_favorites(user_email)
-all_menu_items = get_all_menus_for_week()
+all_menu_items, failed_menus = fetch_all_menus()
+if failed_menus:
+    st.caption(f"Some dishes may be missing: {len(failed_menus)} menus couldn't be loaded right now.")
 dish_options = sorted({item["name"] for item in all_menu_items if item.get("name")})
 
 selected_dish = st.selectbox("Search and select a favorite dish", options=[""] + list(dish_options))
@@ -60,7 +63,7 @@ if selected_dish and st.button("Add Favorite"):
         st.info(f"'{selected_dish}' is already in your favorites.")
     else:
         add_favorite_dish(user_email, selected_dish)
-        push_db_to_github()
+        request_sync()
         st.success(f"Added '{selected_dish}' to your favorites!")
 
 st.subheader("Your Favorite Dishes")
@@ -68,7 +71,7 @@ st.subheader("Your Favorite Dishes")
 if 'delete_favorite' in st.session_state and st.session_state['delete_favorite']:
     to_remove = st.session_state['delete_favorite']
     remove_favorite_dish(user_email, to_remove)
-    push_db_to_github()
+    request_sync()
     st.session_state['delete_favorite'] = None
     st.rerun()
 
@@ -87,8 +90,8 @@ else:
 
 # ----------------- Allergy & Dietary Preferences ----------------- #
 st.header("Allergy & Dietary Preferences")
-aviAllergens = ["Peanut", "Soy", "Dairy", "Egg", "Wheat", "Sesame", "Shellfish", "Fish", "Tree Nut"]
-restrictions = ["Vegetarian", "Vegan", "Gluten Sensitive", "Halal", "Kosher", "Lactose-Intolerant"]
+aviAllergens = ALLERGENS # stored as bitmasks, see dietary.py
+restrictions = RESTRICTIONS
 
 curr_allergens, curr_restrictions = get_user_allergens_and_restrictions(user_email)
 
@@ -102,5 +105,5 @@ new_restrictions = [r for r in restrictions if st.checkbox(r, value=(r in curr_r
 
 if st.button("Save Allergy/Restriction Preferences"):
     allergensUpdate = update_user_allergy_preferences(user_email, new_allergens, new_restrictions)
-    push_db_to_github()
+    request_sync()
     st.success("Preferences saved successfully!")
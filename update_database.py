@@ -4,228 +4,643 @@ from typing import List
 from zoneinfo import ZoneInfo
 import json
 import uuid
+import threading
 
 # All of Prof. Eni Code from fresh-missing repo
                                                              
+import dietary
 from db_sync import get_db_path
+from db_connection import connection
+from migrations import migrate, parse_legacy_favorites, rebuild_daily_totals
 DB_PATH = get_db_path()
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Table for individual users
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT,
-            diningHall TEXT,
-            allergens TEXT,
-            dietaryRestrictions TEXT,
-            favorites TEXT
+# Every function below borrows a pooled connection (db_connection.py)
+# instead of opening and closing its own; `with connection() as conn` commits at
+# the end of the block.
+
+def init_db(db_path=DB_PATH):
+    """Creates the tables, or brings an existing file's schema up to date (see migrations.py)."""
+    migrate(db_path)
+
+# ------ Change Log Methods (delta sync) -------
+# Every write below also records what it changed, keyed by something that is the
+# same on every copy of the DB: users by email and food_journal rows by entry_id
+# (user_id is an autoincrement, so it can differ between copies).
+# Favorites travel as their own user_favorites rows, keyed by email and dish.
+USER_SYNC_COLUMNS = ["email", "diningHall", "allergen_mask", "restriction_mask"]
+JOURNAL_SYNC_COLUMNS = ["entry_id", "date", "meal_type", "food_item", "dining_hall", "notes",
+                        "calories", "protein", "carbs", "fat"]
+
+def _record_change(cursor, table_name, op, row_key, payload=None, changeset_id=None):
+    cursor.execute(
+        "INSERT INTO sync_changes (changeset_id, table_name, op, row_key, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (changeset_id, table_name, op, row_key, json.dumps(payload) if payload is not None else None,
+         datetime.now(ZoneInfo("UTC")).isoformat())
+    )
+
+def record_user_change(cursor, email: str):
+    """Log the current state of a users row so it can be shipped as a delta."""
+    cursor.execute(f"SELECT {', '.join(USER_SYNC_COLUMNS)} FROM users WHERE email = ?", (email,))
+    row = cursor.fetchone()
+    if row:
+        _record_change(cursor, "users", "upsert", email, dict(zip(USER_SYNC_COLUMNS, row)))
+
+def _record_favorite_change(cursor, op, email, dish_name):
+    _record_change(cursor, "user_favorites", op, f"{email}/{dish_name}", {"email": email, "dish_name": dish_name})
+
+def get_pending_changes(conn=None, after_change_id=0):
+    """
+    Changes written locally that haven't been pushed yet, oldest first.
+    Pass conn to read them from a connection that's already open.
+    """
+    if conn is None:
+        with connection() as conn:
+            return get_pending_changes(conn, after_change_id)
+
+    try:
+        rows = conn.execute('''
+            SELECT change_id, table_name, op, row_key, payload, created_at
+            FROM sync_changes WHERE changeset_id IS NULL AND change_id > ? ORDER BY change_id
+        ''', (after_change_id,)).fetchall()
+    except sqlite3.OperationalError:
+        rows = [] # DB file from before the change log existed
+    columns = ["change_id", "table_name", "op", "row_key", "payload", "created_at"]
+    return [dict(zip(columns, row)) for row in rows]
+
+def get_unsynced_changes(conn, known_changesets: set, after_change_id=0):
+    """
+    Every change in conn's change log that a DB whose sync_applied holds
+    known_changesets doesn't have yet: the unpushed ones, plus pushed ones whose
+    changeset (or snapshot) never made it into that DB.
+    """
+    try:
+        rows = conn.execute('''
+            SELECT change_id, changeset_id, table_name, op, row_key, payload, created_at
+            FROM sync_changes WHERE change_id > ? ORDER BY change_id
+        ''', (after_change_id,)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    columns = ["change_id", "changeset_id", "table_name", "op", "row_key", "payload", "created_at"]
+    changes = [dict(zip(columns, row)) for row in rows]
+    return [change for change in changes if change["changeset_id"] not in known_changesets]
+
+def get_last_change_id(conn):
+    try:
+        return conn.execute("SELECT MAX(change_id) FROM sync_changes").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0
+
+def count_pending_changes():
+    """How many changes are waiting in the outbox."""
+    with connection() as conn:
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sync_changes WHERE changeset_id IS NULL").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+def mark_changes_pushed(change_ids: List[int], changeset_id: str):
+    """Stamp pushed changes with their changeset and remember that it's applied here."""
+    with connection() as conn:
+        conn.executemany("UPDATE sync_changes SET changeset_id = ? WHERE change_id = ?",
+                         [(changeset_id, change_id) for change_id in change_ids])
+        conn.execute("INSERT OR IGNORE INTO sync_applied (changeset_id, applied_at) VALUES (?, ?)",
+                     (changeset_id, datetime.now(ZoneInfo("UTC")).isoformat()))
+
+def mark_replayed_changes_pushed(changes: list, changeset_id: str):
+    """
+    mark_changes_pushed for changes whose push was still uploading when a download
+    was swapped in. replay_changes copied them into the new file's outbox with new
+    change_ids, in the same order, so they're matched by what they change.
+    """
+    key = lambda change: (change["table_name"], change["op"], change["row_key"], change["payload"])
+    with connection() as conn:
+        outbox = get_pending_changes(conn)
+    matched, remaining = [], [key(change) for change in changes]
+    for change in outbox:
+        if remaining and key(change) == remaining[0]:
+            matched.append(change["change_id"])
+            remaining.pop(0)
+    mark_changes_pushed(matched, changeset_id)
+
+def get_applied_changesets(db_path=DB_PATH):
+    with connection(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT changeset_id FROM sync_applied")}
+
+def _user_id_for_email(cursor, email):
+    # The user a synced row belongs to, created if this copy hasn't seen them yet
+    cursor.execute("SELECT user_id FROM users WHERE email = ?", (email,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute("INSERT INTO users (email) VALUES (?)", (email,))
+    return cursor.lastrowid
+
+def _apply_change(cursor, change):
+    payload = json.loads(change["payload"]) if change["payload"] else None
+
+    if change["table_name"] == "users" and change["op"] == "upsert":
+        user_id = _user_id_for_email(cursor, change["row_key"])
+        if "allergen_mask" not in payload: # from a replica that still has the text columns
+            payload["allergen_mask"] = dietary.encode_allergens(dietary.parse_legacy_list(payload.get("allergens")))
+            payload["restriction_mask"] = dietary.encode_restrictions(
+                dietary.parse_legacy_list(payload.get("dietaryRestrictions")))
+        columns = [col for col in USER_SYNC_COLUMNS if col != "email"]
+        cursor.execute(
+            f"UPDATE users SET {', '.join(col + ' = ?' for col in columns)} WHERE email = ?",
+            [payload.get(col) for col in columns] + [change["row_key"]]
         )
-    ''')
-
-    # Table for submission summaries
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS food_journal (
-            entry_id TEXT PRIMARY KEY,
-            user_id INTEGER AUTO_INCREMENT,
-            date TEXT,
-            meal_type TEXT,
-            food_item TEXT,
-            dining_hall TEXT,
-            notes TEXT,
-            calories FLOAT,
-            protein FLOAT,
-            carbs FLOAT,
-            fat FLOAT,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        # Changesets from before favorites had their own table carry them here
+        cursor.executemany("INSERT OR IGNORE INTO user_favorites (user_id, dish_name) VALUES (?, ?)",
+                           [(user_id, dish) for dish in parse_legacy_favorites(payload.get("favorites"))])
+
+    elif change["table_name"] == "food_journal" and change["op"] == "upsert":
+        user_id = _user_id_for_email(cursor, payload["email"]) if payload.get("email") else None
+        # Delete then insert rather than INSERT OR REPLACE: REPLACE's implicit delete
+        # doesn't fire the daily_totals triggers, so the old row would stay counted
+        cursor.execute("DELETE FROM food_journal WHERE entry_id = ?", (payload.get("entry_id"),))
+        cursor.execute(
+            f'''INSERT INTO food_journal (user_id, {', '.join(JOURNAL_SYNC_COLUMNS)})
+            VALUES (?, {', '.join('?' for _ in JOURNAL_SYNC_COLUMNS)})''',
+            [user_id] + [payload.get(col) for col in JOURNAL_SYNC_COLUMNS]
         )
-    ''')
 
-    conn.commit()
-    conn.close()
+    elif change["table_name"] == "food_journal" and change["op"] == "delete":
+        cursor.execute("DELETE FROM food_journal WHERE entry_id = ?", (change["row_key"],))
+
+    elif change["table_name"] == "user_favorites" and change["op"] == "upsert":
+        cursor.execute("INSERT OR IGNORE INTO user_favorites (user_id, dish_name) VALUES (?, ?)",
+                       (_user_id_for_email(cursor, payload["email"]), payload["dish_name"]))
+
+    elif change["table_name"] == "user_favorites" and change["op"] == "delete":
+        cursor.execute('''
+            DELETE FROM user_favorites
+            WHERE user_id = (SELECT user_id FROM users WHERE email = ?) AND dish_name = ?
+        ''', (payload["email"], payload["dish_name"]))
+
+def apply_changeset(changeset_id: str, changes: list):
+    """
+    Applies a changeset pulled from GitHub in one transaction. Changesets that are
+    already applied are skipped, so pulling the same one twice is harmless.
+    Returns True if anything was applied.
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sync_applied WHERE changeset_id = ?", (changeset_id,))
+        if cursor.fetchone():
+            return False
+        for change in changes:
+            _apply_change(cursor, change)
+        cursor.execute("INSERT INTO sync_applied (changeset_id, applied_at) VALUES (?, ?)",
+                       (changeset_id, datetime.now(ZoneInfo("UTC")).isoformat()))
+    invalidate_user_profile()
+    return True
+
+def replay_changes(changes: list, db_path=DB_PATH, clear_outbox=True):
+    """
+    Re-applies our local changes on top of a freshly downloaded DB file and copies
+    them into its change log: unpushed ones go back in the outbox, pushed ones keep
+    their changeset, which then counts as applied in that file. Whatever was in the
+    downloaded file's change log belonged to the replica that uploaded it, so that
+    gets cleared first unless clear_outbox=False.
+    """
+    now = datetime.now(ZoneInfo("UTC")).isoformat()
+    with connection(db_path) as conn:
+        cursor = conn.cursor()
+        if clear_outbox:
+            cursor.execute("DELETE FROM sync_changes")
+        for change in changes:
+            _apply_change(cursor, change)
+            _record_change(cursor, change["table_name"], change["op"], change["row_key"],
+                           json.loads(change["payload"]) if change["payload"] else None,
+                           change.get("changeset_id"))
+            if change.get("changeset_id"):
+                cursor.execute("INSERT OR IGNORE INTO sync_applied (changeset_id, applied_at) VALUES (?, ?)",
+                               (change["changeset_id"], now))
 
 def fetch_food_journal():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("SELECT * FROM food_journal")
-    entries = cursor.fetchall()
-    conn.close()
+        cursor.execute("SELECT * FROM food_journal")
+        entries = cursor.fetchall()
 
     return entries
 
-def fetch_user_info(email: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-    user_info = cursor.fetchone()
-    conn.close()
+# ------ User Profile Cache -------
+# A page render asks for the same users row several times (user_id, dining hall,
+# allergen masks, favorites), each of which used to be its own query. The row and
+# the favorites are loaded once per email and kept until something writes to them:
+# the update functions below, store_new_user_info, the favorite mutators, an
+# applied changeset or db_sync swapping in a downloaded file. The cache is shared
+# by every session in the process, so a write in one session is seen by the rest.
+_profile_cache = {}               # email -> {"user": users row, "favorites": [dish, ...]}
+_profile_cache_lock = threading.Lock()
+_profile_cache_epoch = 0          # bumped by every invalidation, so a load that raced a write isn't kept
+
+profile_cache_stats = {
+    "hits": 0,
+    "misses": 0,            # loaded from the DB
+    "invalidations": 0,
+}
+
+def get_user_profile(email: str):
+    """
+    {"user": users row (sqlite3.Row) or None, "favorites": [dish, ...]} for email.
+    Unknown emails aren't cached, so the row shows up as soon as it's created.
+    """
+    with _profile_cache_lock:
+        profile = _profile_cache.get(email)
+        if profile is not None:
+            profile_cache_stats["hits"] += 1
+            return profile
+        profile_cache_stats["misses"] += 1
+        epoch = _profile_cache_epoch
+
+    with connection() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        user = c.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        favorites = [row[0] for row in c.execute(
+            "SELECT dish_name FROM user_favorites WHERE user_id = ? ORDER BY id", (user["user_id"],))] if user else []
+    profile = {"user": user, "favorites": tuple(favorites)}
+
+    if user is not None:
+        with _profile_cache_lock:
+            if _profile_cache_epoch == epoch:
+                _profile_cache[email] = profile
+    return profile
+
+def invalidate_user_profile(email: str = None):
+    """Drops email's cached profile, or every cached profile if email is None. Call it after the write commits."""
+    global _profile_cache_epoch
+    with _profile_cache_lock:
+        _profile_cache_epoch += 1
+        if email is None:
+            _profile_cache.clear()
+        else:
+            _profile_cache.pop(email, None)
+        profile_cache_stats["invalidations"] += 1
+
+def get_profile_cache_stats():
+    with _profile_cache_lock:
+        stats = dict(profile_cache_stats)
+        stats["cached"] = len(_profile_cache)
+    return stats
 
-    return user_info
+def fetch_user_info(email: str):
+    return get_user_profile(email)["user"]
 
 def checkNewUser(email:str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT email FROM users WHERE email = ?", (email,))
-
-    userInfo = cursor.fetchone()
+    return fetch_user_info(email) is None
 
-    return str(type(userInfo)) == "<class 'NoneType'>"
 
+def store_new_user_info(email: str, diningHall: str, allergens: list, dietaryRestrictions: list):
+    with connection() as conn:
+        cursor = conn.cursor()
 
-def store_new_user_info(email: str, diningHall: str, allergens: str, dietaryRestrictions: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("INSERT INTO users (email, diningHall, allergens, dietaryRestrictions) VALUES (?, ?, ?, ?)", (email, diningHall, allergens, dietaryRestrictions))
-
-    conn.commit()
-    conn.close()
+        # The food journal page may already have created a bare row for this email
+        cursor.execute('''
+            INSERT INTO users (email, diningHall, allergen_mask, restriction_mask) VALUES (?, ?, ?, ?)
+            ON CONFLICT (email) DO UPDATE SET diningHall = excluded.diningHall, allergen_mask = excluded.allergen_mask,
+                restriction_mask = excluded.restriction_mask
+        ''', (email, diningHall, dietary.encode_allergens(allergens), dietary.encode_restrictions(dietaryRestrictions)))
+        record_user_change(cursor, email)
+    invalidate_user_profile(email)
 
 def getUserFavDiningHall(user):
-    conn = sqlite3.connect(DB_PATH) # adding local path to private repo
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT diningHall FROM users WHERE email = ?", (user.get("email"),))
-
-    # Source on try/except - https://www.geeksforgeeks.org/python-exception-handling/
-    try:
-        diningHall = cursor.fetchone()[0]
-    except TypeError:
-        diningHall = "" # making this default for now!
-
-    conn.close()
-
-    return diningHall
+    user_info = fetch_user_info(user.get("email"))
+    if user_info is None:
+        return "" # making this default for now!
+    return user_info["diningHall"]
 
 # ------ Food Journal Methods -------
 def get_or_create_user(email):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE email = ?", (email,))
-    result = c.fetchone()
-    if result:
-        user_id = result[0]
-    else:
-        c.execute("INSERT INTO users (email) VALUES (?)", (email,))
-        conn.commit()
-        user_id = c.lastrowid
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT user_id FROM users WHERE email = ?", (email,))
+        result = c.fetchone()
+        if result:
+            user_id = result[0]
+        else:
+            c.execute("INSERT INTO users (email) VALUES (?)", (email,))
+            user_id = c.lastrowid
+            record_user_change(c, email)
     return user_id
 
 def add_food_entry(user_id, date, meal_type, food_item, dining_hall, notes="", calories=0.0, protein=0.0, carbs=0.0, fat=0.0):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    entry_id = str(uuid.uuid4())
-
-    query = '''
+    return add_food_entries(user_id, [{
+        "date": date, "meal_type": meal_type, "food_item": food_item, "dining_hall": dining_hall,
+        "notes": notes, "calories": calories, "protein": protein, "carbs": carbs, "fat": fat,
+    }])[0]
+
+def add_food_entries(user_id, entries):
+    """
+    Inserts any number of journal entries for one user in a single transaction
+    and returns their new entry_ids, in order. Each entry is a dict with the
+    add_food_entry arguments (date, meal_type, food_item, dining_hall, and
+    optionally notes, calories, protein, carbs, fat).
+    """
+    rows = []
+    for entry in entries:
+        rows.append({
+            "entry_id": str(uuid.uuid4()),
+            "date": entry["date"],
+            "meal_type": entry["meal_type"],
+            "food_item": entry["food_item"],
+            "dining_hall": entry["dining_hall"],
+            "notes": entry.get("notes", ""),
+            "calories": entry.get("calories", 0.0),
+            "protein": entry.get("protein", 0.0),
+            "carbs": entry.get("carbs", 0.0),
+            "fat": entry.get("fat", 0.0),
+        })
+    if not rows:
+        return []
+
+    query = f'''
     INSERT INTO food_journal 
-    (entry_id, user_id, date, meal_type, food_item, dining_hall, notes, calories, protein, carbs, fat) 
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    (user_id, {', '.join(JOURNAL_SYNC_COLUMNS)}) 
+    VALUES (?, {', '.join('?' for _ in JOURNAL_SYNC_COLUMNS)})
     '''
-    c.execute(query, (entry_id, user_id, date, meal_type, food_item, dining_hall, notes, calories, protein, carbs, fat))
+    with connection() as conn:
+        c = conn.cursor()
+        c.executemany(query, ([user_id] + [row[col] for col in JOURNAL_SYNC_COLUMNS] for row in rows))
+
+        # One change log row per entry, built from what we just inserted rather
+        # than reading each entry back
+        c.execute("SELECT email FROM users WHERE user_id = ?", (user_id,))
+        user = c.fetchone()
+        email = user[0] if user else None
+        now = datetime.now(ZoneInfo("UTC")).isoformat()
+        c.executemany(
+            "INSERT INTO sync_changes (changeset_id, table_name, op, row_key, payload, created_at) VALUES (NULL, ?, ?, ?, ?, ?)",
+            (("food_journal", "upsert", row["entry_id"], json.dumps(dict(row, email=email)), now) for row in rows)
+        )
 
-    conn.commit()
-    conn.close()
-    return entry_id
+    return [row["entry_id"] for row in rows]
 
 def get_food_entries(user_id, date=None):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-
-    if date:
-        c.execute('''
-    SELECT entry_id, user_id, date, meal_type, food_item, dining_hall, notes, 
-           calories, protein, carbs, fat
-    FROM food_journal 
-    WHERE user_id = ? AND date = ? 
-    ORDER BY meal_type
-''', (user_id, date))
-    else:
-        c.execute('''
-    SELECT entry_id, user_id, date, meal_type, food_item, dining_hall, notes, 
-           calories, protein, carbs, fat
-    FROM food_journal 
-    WHERE user_id = ? 
-    ORDER BY date DESC, meal_type
-''', (user_id,))
-
-    rows = c.fetchall()
+    with connection() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row # on the cursor, not the shared connection
+
+        if date:
+            c.execute('''
+        SELECT entry_id, user_id, date, meal_type, food_item, dining_hall, notes, 
+               calories, protein, carbs, fat
+        FROM food_journal 
+        WHERE user_id = ? AND date = ? 
+        ORDER BY meal_type
+    ''', (user_id, date))
+        else:
+            c.execute('''
+        SELECT entry_id, user_id, date, meal_type, food_item, dining_hall, notes, 
+               calories, protein, carbs, fat
+        FROM food_journal 
+        WHERE user_id = ? 
+        ORDER BY date DESC, meal_type
+    ''', (user_id,))
+
+        rows = c.fetchall()
     entries = [dict(row) for row in rows]
-    conn.close()
     return entries
 
+# ------ Journal History -------
+JOURNAL_COLUMNS = "entry_id, user_id, date, meal_type, food_item, dining_hall, notes, calories, protein, carbs, fat"
+
+def get_food_entries_page(user_id, page_size=50, after=None):
+    """
+    One page of user_id's journal, ordered date DESC, meal_type, entry_id.
+    Returns (entries, next_cursor); pass next_cursor back as `after` for the
+    next page. next_cursor is None on the last page.
+
+    The cursor is the (date, meal_type, entry_id) of the previous page's last
+    entry. Continuing from it instead of an OFFSET means page 1000 costs the same
+    as page 1: SQLite seeks to the cursor in idx_food_journal_user_history and
+    reads page_size rows from there.
+    """
+    where, params = "user_id = ?", [user_id]
+    undated_tail = False
+    if after is not None:
+        date, meal_type, entry_id = after
+        # NULL meal types sort first within a day
+        if meal_type is None:
+            later_same_day = "(meal_type IS NULL AND entry_id > ?) OR meal_type IS NOT NULL"
+            later_params = [entry_id]
+        else:
+            later_same_day = "(meal_type, entry_id) > (?, ?)"
+            later_params = [meal_type, entry_id]
+        if date is None:
+            where += f" AND date IS NULL AND ({later_same_day})"
+            params += later_params
+        else:
+            where += f" AND date <= ? AND (date < ? OR (date = ? AND ({later_same_day})))"
+            params += [date, date, date] + later_params
+            # Entries with no date sort after every dated one, but `date <= ?` never
+            # matches them (and an OR for them would cost the index range), so
+            # they're read separately once the dated ones run out
+            undated_tail = True
+
+    with connection() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(f'''
+            SELECT {JOURNAL_COLUMNS} FROM food_journal WHERE {where}
+            ORDER BY date DESC, meal_type, entry_id LIMIT ?
+        ''', params + [page_size + 1])
+        rows = c.fetchall()
+        if undated_tail and len(rows) <= page_size:
+            c.execute(f'''
+                SELECT {JOURNAL_COLUMNS} FROM food_journal WHERE user_id = ? AND date IS NULL
+                ORDER BY meal_type, entry_id LIMIT ?
+            ''', (user_id, page_size + 1 - len(rows)))
+            rows += c.fetchall()
+
+    entries = [dict(row) for row in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = entries[-1]
+        next_cursor = (last["date"], last["meal_type"], last["entry_id"])
+    return entries, next_cursor
+
+def iter_food_entries(user_id, page_size=500):
+    """
+    Yields every entry of user_id's journal in history order, one page query at
+    a time. No connection is held between pages, so a suspended generator doesn't
+    hold up a DB swap.
+    """
+    after = None
+    while True:
+        entries, after = get_food_entries_page(user_id, page_size, after)
+        yield from entries
+        if after is None:
+            return
+
+# ------ Metrics Rollups -------
+# Sums of one user's journal per day/week/month/year, done with GROUP BY in SQLite
+# so the metrics page only gets back one row per bucket, and only for that user.
+# They read daily_totals (one row per user, day and meal type, kept current by
+# triggers, see migrations._daily_totals) rather than every journal entry.
+# Journal dates are stored as YYYY-MM-DD, so string comparison is date order.
+ROLLUP_PERIODS = {
+    "day": "date",
+    "week": "date(date, 'weekday 0', '-6 days')", # Monday, like pandas' W periods
+    "month": "strftime('%Y-%m-01', date)",
+    "year": "strftime('%Y-01-01', date)",
+}
+
+def get_macro_rollup(user_id, period="day", start_date=None, end_date=None, by_meal_type=False):
+    """
+    Calorie, protein, carb and fat sums (and entry counts) for user_id, one dict
+    per period, oldest first. period_start is the bucket's first day as
+    YYYY-MM-DD. start_date/end_date (inclusive, YYYY-MM-DD) limit the range;
+    by_meal_type splits each bucket by meal type; entries without one (stored as
+    '' in daily_totals) come back as "Other".
+    """
+    bucket = ROLLUP_PERIODS[period]
+    group_by = ["period_start"] + (["meal_type"] if by_meal_type else [])
+    meal_type = "IFNULL(NULLIF(meal_type, ''), 'Other') AS meal_type," if by_meal_type else ""
+    query = f'''
+        SELECT {bucket} AS period_start, {meal_type}
+               SUM(calories) AS calories, SUM(protein) AS protein, SUM(carbs) AS carbs,
+               SUM(fat) AS fat, SUM(entries) AS entries
+        FROM daily_totals
+        WHERE user_id = ? AND date >= ? AND date <= ? AND {bucket} IS NOT NULL
+        GROUP BY {', '.join(group_by)}
+        ORDER BY {', '.join(group_by)}
+    '''
+    with connection() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(query, (user_id, start_date or "0000-00-00", end_date or "9999-12-31"))
+        rows = c.fetchall()
+    return [dict(row) for row in rows]
+
+def get_journal_date_range(user_id):
+    """(first, last) date user_id has logged, or (None, None)."""
+    with connection() as conn:
+        row = conn.execute("SELECT MIN(date), MAX(date) FROM daily_totals WHERE user_id = ? AND date != ''",
+                           (user_id,)).fetchone()
+    return row[0], row[1]
+
+def get_dining_hall_visits(user_id, start_date, end_date):
+    """user_id's dining hall for each entry between the two dates, in the order they were eaten."""
+    with connection() as conn:
+        rows = conn.execute('''
+            SELECT dining_hall FROM food_journal
+            WHERE user_id = ? AND date >= ? AND date <= ? AND dining_hall IS NOT NULL
+            ORDER BY date, rowid
+        ''', (user_id, start_date, end_date)).fetchall()
+    return [row[0] for row in rows]
+
+def verify_daily_totals():
+    """
+    Compares daily_totals with sums computed from food_journal right now and
+    returns the (user_id, date, meal_type) keys that don't match (empty if it's right).
+    """
+    columns = ["calories", "protein", "carbs", "fat", "entries"]
+    with connection() as conn:
+        stored = {row[:3]: row[3:] for row in conn.execute(
+            f"SELECT user_id, date, meal_type, {', '.join(columns)} FROM daily_totals")}
+        actual = {row[:3]: row[3:] for row in conn.execute('''
+            SELECT user_id, IFNULL(date, ''), IFNULL(meal_type, ''), TOTAL(calories), TOTAL(protein),
+                   TOTAL(carbs), TOTAL(fat), COUNT(*)
+            FROM food_journal WHERE user_id IS NOT NULL
+            GROUP BY user_id, IFNULL(date, ''), IFNULL(meal_type, '')
+        ''')}
+    # Sums kept up by adding and subtracting can be off by float rounding
+    return sorted(key for key in stored.keys() | actual.keys()
+                  if key not in stored or key not in actual
+                  or any(abs(a - b) > 1e-6 * max(1, abs(b)) for a, b in zip(stored[key], actual[key])))
+
+def rebuild_and_verify_daily_totals():
+    """Recomputes daily_totals from scratch; returns verify_daily_totals() afterwards."""
+    with connection() as conn:
+        rebuild_daily_totals(conn.cursor())
+    return verify_daily_totals()
+
 def delete_food_entry(entry_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM food_journal WHERE entry_id = ?", (entry_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM food_journal WHERE entry_id = ?", (entry_id,))
+        _record_change(c, "food_journal", "delete", entry_id)
     return True
 
 # --------------------------------------Settings Page Methods ---------------------------------------
 def update_user_dining_hall(email: str, dining_hall: str):
-    with sqlite3.connect(DB_PATH) as conn:
+    with connection() as conn:
         conn.execute("UPDATE users SET diningHall = ? WHERE email = ?", (dining_hall, email))
-        conn.commit()
+        record_user_change(conn.cursor(), email)
+    invalidate_user_profile(email)
 
+# Favorites are rows in user_favorites (see migrations._normalize_favorites), so
+# adding or removing one doesn't read and rewrite the whole list.
 def get_user_favorites(email: str):
-    with sqlite3.connect(DB_PATH) as conn:
+    """email's favorite dishes, oldest first."""
+    return list(get_user_profile(email)["favorites"])
+
+def add_favorite_dishes(email: str, dishes):
+    """Adds dishes to email's favorites and returns the ones that weren't already there."""
+    with connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT favorites FROM users WHERE email = ?", (email,))
+        cursor.execute("SELECT user_id FROM users WHERE email = ?", (email,))
         row = cursor.fetchone()
-        return json.loads(row[0]) if row and row[0] else []
+        if row is None:
+            return []
+        existing = {r[0] for r in cursor.execute("SELECT dish_name FROM user_favorites WHERE user_id = ?", row)}
+        added = [dish for dish in dict.fromkeys(dishes) if dish and dish not in existing]
+        cursor.executemany("INSERT INTO user_favorites (user_id, dish_name) VALUES (?, ?)",
+                           [(row[0], dish) for dish in added])
+        for dish in added:
+            _record_favorite_change(cursor, "upsert", email, dish)
+    if added:
+        invalidate_user_profile(email)
+    return added
+
+def remove_favorite_dishes(email: str, dishes):
+    """Removes dishes from email's favorites and returns the ones that were there."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM users WHERE email = ?", (email,))
+        row = cursor.fetchone()
+        if row is None:
+            return []
+        existing = {r[0] for r in cursor.execute("SELECT dish_name FROM user_favorites WHERE user_id = ?", row)}
+        removed = [dish for dish in dict.fromkeys(dishes) if dish in existing]
+        cursor.executemany("DELETE FROM user_favorites WHERE user_id = ? AND dish_name = ?",
+                           [(row[0], dish) for dish in removed])
+        for dish in removed:
+            _record_favorite_change(cursor, "delete", email, dish)
+    if removed:
+        invalidate_user_profile(email)
+    return removed
 
 def add_favorite_dish(email: str, new_dish: str):
-    favorites = get_user_favorites(email)
-    if new_dish not in favorites:
-        favorites.append(new_dish)
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("UPDATE users SET favorites = ? WHERE email = ?", (json.dumps(favorites), email))
-            conn.commit()
-    return favorites
+    add_favorite_dishes(email, [new_dish])
+    return get_user_favorites(email)
 
 def remove_favorite_dish(email: str, dish: str):
-    favorites = get_user_favorites(email)
-    if dish in favorites:
-        favorites.remove(dish)
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("UPDATE users SET favorites = ? WHERE email = ?", (json.dumps(favorites), email))
-            conn.commit()
-    return favorites
+    remove_favorite_dishes(email, [dish])
+    return get_user_favorites(email)
+
+def get_users_who_favorited(dish_name: str):
+    """Emails of everyone who has dish_name as a favorite."""
+    with connection() as conn:
+        rows = conn.execute('''
+            SELECT u.email FROM user_favorites f JOIN users u ON u.user_id = f.user_id
+            WHERE f.dish_name = ? ORDER BY u.email
+        ''', (dish_name,)).fetchall()
+    return [row[0] for row in rows]
+
+# Allergens and restrictions are bitmasks over dietary.ALLERGENS / dietary.RESTRICTIONS
+def get_user_dietary_masks(email: str):
+    """(allergen mask, restriction mask) for email; (0, 0) if there's no such user."""
+    user = fetch_user_info(email)
+    return (user["allergen_mask"], user["restriction_mask"]) if user else (0, 0)
 
 def get_user_allergens_and_restrictions(email: str):
-    import ast
-    
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT allergens, dietaryRestrictions FROM users WHERE email = ?", (email,))
-        row = cursor.fetchone()
-        
-        curr_allergens = []
-        curr_restrictions = []
-        
-        if row and row[0]:
-            try:
-                curr_allergens = ast.literal_eval(row[0])
-            except (SyntaxError, ValueError):
-                # Fallback to empty list if parsing fails
-                pass
-        
-        if row and row[1]:
-            try:
-                curr_restrictions = ast.literal_eval(row[1])
-            except (SyntaxError, ValueError):
-                # Fallback to empty list if parsing fails
-                pass
-        
-        return curr_allergens, curr_restrictions
+    allergen_mask, restriction_mask = get_user_dietary_masks(email)
+    return dietary.decode_allergens(allergen_mask), dietary.decode_restrictions(restriction_mask)
 
 
 def update_user_allergy_preferences(email: str, allergens: list, restrictions: list):
@@ -235,22 +650,25 @@ def update_user_allergy_preferences(email: str, allergens: list, restrictions: l
     if not isinstance(restrictions, list):
         restrictions = [restrictions] if restrictions else []
     
-    # Convert to JSON
-    allergens_json = json.dumps(allergens)
-    restrictions_json = json.dumps(restrictions)
-    
-    with sqlite3.connect(DB_PATH) as conn:
+    with connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute(
-            "UPDATE users SET allergens = ?, dietaryRestrictions = ? WHERE email = ?",
-            (allergens_json, restrictions_json, email)
+            "UPDATE users SET allergen_mask = ?, restriction_mask = ? WHERE email = ?",
+            (dietary.encode_allergens(allergens), dietary.encode_restrictions(restrictions), email)
         )
-        
-        conn.commit()
-        return True
+        record_user_change(cursor, email)
+    invalidate_user_profile(email)
+    return True
     
 # Call this once in your main app to initialize the DB (if not already)
+# python update_database.py rebuild-daily-totals  - recompute daily_totals and check it
 if __name__ == "__main__":
+    import sys
+
     init_db()
     print("Database initialized.")
+    if sys.argv[1:] == ["rebuild-daily-totals"]:
+        mismatched = rebuild_and_verify_daily_totals()
+        print(f"daily_totals rebuilt, {len(mismatched)} mismatched rows" + (f": {mismatched[:10]}" if mismatched else ""))
+        sys.exit(1 if mismatched else 0)
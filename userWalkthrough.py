@@ -1,6 +1,7 @@
 import streamlit as st
 from update_database import store_new_user_info
-from db_sync import push_db_to_github
+from db_sync import request_sync
+from dietary import ALLERGENS, RESTRICTIONS
 
 
 def any_allergens_selected(): # Source - Prof. Eni code
@@ -40,7 +41,7 @@ def newUser(user):
         st.subheader("Allergy Information")
         st.write("Are you allergic to any of the following?")
 
-        aviAllergens = ["Peanut", "Soy", "Dairy", "Egg", "Wheat", "Sesame", "Shellfish", "Fish", "Tree Nut"]
+        aviAllergens = ALLERGENS # stored as a bitmask, see dietary.py
 
         titleCols = st.columns(2)
         titleCols[0].write("Allergen")
@@ -69,7 +70,7 @@ def newUser(user):
     
 
         # Dietary Restrictions
-        restrictions = ["Vegetarian", "Vegan", "Gluten Sensitive", "Halal", "Kosher", "Lactose-Intolerant"]
+        restrictions = RESTRICTIONS
 
         st.write("Do you have any dietary restrictions/preferences? (Click the Submit button if you have or have not selected any of the following restrictions/preferences)")
         st.write("IMPORTANT NOTE: Developers are still working on integrating the following dietary restrictions/preferences: 'Halal', 'Kosher', and 'Lactose_Intolerant' --- so as of now, the menus will not filter out these restrictions/preferences but as soon as our team has finished integrating it, the menus will reflect those changes. Thank you for your patience!")
@@ -103,10 +104,10 @@ def newUser(user):
             next = st.button("Next", key = "nextPageHome")
 
             if next:
-                store_new_user_info(email, favHall, str(userAllergens), str(userDietaryRestrictions)) 
+                store_new_user_info(email, favHall, userAllergens, userDietaryRestrictions) 
                 st.success(f"Saved!")
 
-                push_db_to_github()
+                request_sync()
                                  
                 return True
 
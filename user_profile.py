@@ -1,12 +1,12 @@
 # -- Prof. Eni code -- #
 import streamlit as st
-import requests
+import http_client
 
 @st.cache_data(ttl=3600)
 def get_user_info(access_token):
     """Fetch and cache user profile info from Google."""
     try:
-        response = requests.get(
+        response = http_client.get(
             "https://www.googleapis.com/oauth2/v3/userinfo",
             headers={"Authorization": f"Bearer {access_token}"},
             timeout=10